@@ -18,7 +18,7 @@ class AESCipher:
         """
         self._key = key
         self._iv_length = iv_length
-        self._cipher = Cipher(algorithms.AES(key), modes.CBC(urandom(iv_length)), backend=default_backend())
+        self._algorithm = algorithms.AES(key)
 
     def encrypt(self, content):
         """
@@ -33,9 +33,9 @@ class AESCipher:
         if padding != 0:
             content += ''.join(self.padding_value for i in range(16 - padding))
 
+        # a cipher per call keeps the AESCipher safe to share between threads
         iv = urandom(self._iv_length)
-        self._cipher.mode = modes.CBC(iv)
-        encryptor = self._cipher.encryptor()
+        encryptor = Cipher(self._algorithm, modes.CBC(iv), backend=default_backend()).encryptor()
         ct = encryptor.update(content) + encryptor.finalize()
         return iv + ct
 
@@ -49,8 +49,7 @@ class AESCipher:
         :returns: Unencrypted string.
         """
         iv = content[:self._iv_length]
-        self._cipher.mode = modes.CBC(iv)
-        decryptor = self._cipher.decryptor()
+        decryptor = Cipher(self._algorithm, modes.CBC(iv), backend=default_backend()).decryptor()
         content = decryptor.update(content[self._iv_length:]) + decryptor.finalize()
         return content.rstrip(self.padding_value)
 
@@ -0,0 +1,115 @@
+"""
+Backpressure.py throttles the scheduler while the Redis Q is deep or the Redis server is running out of memory, so queueing
+a large data file does not push the Redis VM into swap or maxmemory eviction.
+"""
+import time
+from config import Config
+
+BYTES_PER_MB = 1024 * 1024
+
+# fraction of a high-water mark used as its low-water mark when the low-water mark is not configured
+DEFAULT_LOW_WATER_FRACTION = 0.8
+
+def get_low_water(name, high_water, low_water):
+    """
+    :param str name: name of the mark, used in the error message
+    :param float high_water: the configured high-water mark, 0 when the check is disabled
+    :param float low_water: the configured low-water mark, 0 to derive it from the high-water mark
+    :return: the low-water mark to resume at
+    :rtype: float
+    """
+    if high_water <= 0:
+        return 0
+    if low_water <= 0:
+        return high_water * DEFAULT_LOW_WATER_FRACTION
+    if low_water >= high_water:
+        raise Exception("The {0} low-water mark {1} must be below its high-water mark {2}".format(name, low_water, high_water))
+    return low_water
+
+class Backpressure(object):
+    """
+    Pauses enqueueing above the configured high-water marks and resumes once the queue depth and the redis memory are back
+    below the low-water marks. A high-water mark of 0 disables that check, a low-water mark of 0 resumes at
+    DEFAULT_LOW_WATER_FRACTION of the high-water mark.
+    """
+    def __init__(self, logger, redis_conn, queue):
+        """
+        :param logger logger: the logger
+        :param object redis_conn: Redis connection object
+        :param Queue queue: the Redis Q queue that jobs are enqueued to
+        """
+        self.logger = logger
+        self.config = Config()
+        self.redis_conn = redis_conn
+        self.queue = queue
+        self.throttled = False
+        self.queue_low_water = get_low_water('queue', self.config.scheduler_queue_high_water,
+            self.config.scheduler_queue_low_water)
+        self.memory_low_water_mb = get_low_water('redis memory', self.config.scheduler_redis_memory_high_water_mb,
+            self.config.scheduler_redis_memory_low_water_mb)
+
+    def is_enabled(self):
+        """
+        :return: True when at least one high-water mark is configured
+        :rtype: boolean
+        """
+        return self.config.scheduler_queue_high_water > 0 or self.config.scheduler_redis_memory_high_water_mb > 0
+
+    def measure(self):
+        """
+        Measures the queue depth and the memory used by the redis server
+
+        :return: tuple of the number of queued jobs and the used memory in MB
+        """
+        depth = self.queue.count
+        memory_mb = 0.0
+        if self.config.scheduler_redis_memory_high_water_mb > 0:
+            memory_mb = float(self.redis_conn.info('memory')['used_memory']) / BYTES_PER_MB
+
+        return depth, memory_mb
+
+    def is_above_high_water(self, depth, memory_mb):
+        """
+        :param int depth: number of queued jobs
+        :param float memory_mb: memory used by the redis server in MB
+        :return: True when either measurement is above its high-water mark
+        :rtype: boolean
+        """
+        return ((self.config.scheduler_queue_high_water > 0 and depth >= self.config.scheduler_queue_high_water) or
+            (self.config.scheduler_redis_memory_high_water_mb > 0 and memory_mb >= self.config.scheduler_redis_memory_high_water_mb))
+
+    def is_below_low_water(self, depth, memory_mb):
+        """
+        :param int depth: number of queued jobs
+        :param float memory_mb: memory used by the redis server in MB
+        :return: True when both measurements are below their low-water marks
+        :rtype: boolean
+        """
+        return ((self.config.scheduler_queue_high_water <= 0 or depth <= self.queue_low_water) and
+            (self.config.scheduler_redis_memory_high_water_mb <= 0 or memory_mb <= self.memory_low_water_mb))
+
+    def wait(self):
+        """
+        Blocks while enqueueing is throttled. Call before every batch is enqueued.
+
+        :return: seconds spent waiting
+        :rtype: float
+        """
+        if not self.is_enabled():
+            return 0.0
+
+        depth, memory_mb = self.measure()
+        if not self.is_above_high_water(depth, memory_mb):
+            return 0.0
+
+        self.throttled = True
+        self.logger.info('Pausing enqueueing, %d jobs queued and redis is using %.1f MB', depth, memory_mb)
+        start = time.time()
+        while self.throttled:
+            time.sleep(self.config.scheduler_backpressure_poll_sec)
+            depth, memory_mb = self.measure()
+            self.throttled = not self.is_below_low_water(depth, memory_mb)
+
+        waited = time.time() - start
+        self.logger.info('Resuming enqueueing after %.1f seconds, %d jobs queued and redis is using %.1f MB', waited, depth, memory_mb)
+        return waited
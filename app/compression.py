@@ -0,0 +1,111 @@
+"""
+Compression.py compresses record and result payloads before they are encrypted.
+
+A compressed payload starts with a header: a marker byte, a version byte, the codec byte and the length of the
+compressed data, so payloads written without compression still decode as they are. The length restores trailing zero
+bytes of the compressed data that AESCipher.decrypt strips as padding.
+
+zlib is always available, lz4 (pip install lz4) and zstd (pip install zstandard) are used when they are installed.
+"""
+import struct
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MARKER = '\x1f'
+VERSION = 1
+HEADER = struct.Struct('>cBBI')
+
+CODECS = {
+    'zlib': 1,
+    'lz4': 2,
+    'zstd': 3
+}
+
+def get_available_codecs():
+    """
+    :return: names of the codecs that can be used in this environment
+    :rtype: list
+    """
+    available = ['zlib']
+    if lz4 is not None:
+        available.append('lz4')
+    if zstandard is not None:
+        available.append('zstd')
+    return available
+
+class PayloadCompressor(object):
+    """
+    Compresses payloads with the configured codec and decompresses payloads of any codec
+    """
+    def __init__(self, codec='none', level=None):
+        """
+        :param str codec: none, zlib, lz4 or zstd
+        :param int level: compression level, None for the codec default
+        """
+        if codec != 'none' and codec not in CODECS:
+            raise Exception("Unknown payload compression codec '{0}'".format(codec))
+        if codec != 'none' and codec not in get_available_codecs():
+            raise Exception("Payload compression codec '{0}' is not installed".format(codec))
+
+        self.codec = codec
+        self.level = level
+
+    def _compress(self, payload):
+        if self.codec == 'zlib':
+            return zlib.compress(payload, self.level if self.level is not None else 6)
+        if self.codec == 'lz4':
+            return lz4.frame.compress(payload, compression_level=self.level or 0)
+        return zstandard.ZstdCompressor(level=self.level or 3).compress(payload)
+
+    def encode(self, payload):
+        """
+        Compresses a payload
+
+        :param str payload: the payload
+        :return: the compressed payload with its header, the payload itself when compression is off or does not make it
+            smaller
+        :rtype: str
+        """
+        if self.codec == 'none':
+            return payload
+
+        compressed = self._compress(payload)
+        if len(compressed) + HEADER.size >= len(payload):
+            return payload
+
+        return HEADER.pack(MARKER, VERSION, CODECS[self.codec], len(compressed)) + compressed
+
+    def decode(self, payload):
+        """
+        Decompresses a payload
+
+        :param str payload: a payload returned by encode, after AESCipher.decrypt
+        :return: the original payload
+        :rtype: str
+        """
+        if len(payload) < HEADER.size or payload[0] != MARKER:
+            return payload
+
+        marker, version, codec, length = HEADER.unpack(payload[:HEADER.size])
+        if version != VERSION:
+            raise Exception("Unknown compressed payload version {0}".format(version))
+
+        compressed = payload[HEADER.size:]
+        compressed += '\0' * (length - len(compressed))
+
+        if codec == CODECS['zlib']:
+            return zlib.decompress(compressed)
+        if codec == CODECS['lz4'] and lz4 is not None:
+            return lz4.frame.decompress(compressed)
+        if codec == CODECS['zstd'] and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompress(compressed)
+        raise Exception("Compressed payload codec {0} is not installed".format(codec))
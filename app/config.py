@@ -42,15 +42,63 @@ class Config(object):
     logger_queue_name = "logger"
     logger_queue_sas = ""
     scheduled_jobs_count_redis_key = "totalScheduledJobsCount"
+    scheduler_enqueue_batch_size = 500
+    scheduler_records_per_job = 1
+    scheduler_job_target_payload_kb = 64
+    scheduler_processes = 1
+    scheduler_checkpoint_redis_key_prefix = "scheduler-checkpoint-"
+    scheduler_queue_high_water = 0
+    scheduler_queue_low_water = 0
+    scheduler_redis_memory_high_water_mb = 0
+    scheduler_redis_memory_low_water_mb = 0
+    scheduler_backpressure_poll_sec = 5
+    scheduler_enqueue_by_reference = False
+    data_reference_read_mode = "cache"
+    processor_worker_mode = "fork"
+    processor_worker_max_jobs = 1000
+    processor_worker_max_rss_mb = 512
+    processor_pipeline_window = 8
+    processor_prefetch_count = 1
+    processor_prefetch_sweep_interval_sec = 30
+    processor_min_processes = 0
+    processor_max_processes = 0
+    processor_scale_interval_sec = 30
+    processor_scale_io_bound_ratio = 0.5
+    processor_scale_max_load = 1.5
+    processing_kernel = "native"
+    processing_kernel_library = "cpp/libprogram.so"
+    processing_kernel_duration_sec = 1
+    workload_profile = ""
+    workload_profiles = {}
+    payload_compression = "none"
+    payload_compression_level = None
     results_queue_name = "results"
     results_queue_sas_token = ""
     results_container_name = "results"
     results_consolidated_file = ""
     results_consolidated_count_redis_key = "consolidatedResultsCount"
+    results_consolidated_shards = 1
+    results_consolidated_shard_max_blocks = 49000
+    results_consolidated_shards_redis_key = "consolidatedResultsShards"
+    results_consolidated_format = "text"
     results_container_sas_token = ""
+    results_pack_max_count = 1
+    results_pack_max_bytes = 65536
+    results_pack_max_delay_sec = 1
+    results_consolidation_concurrency = 4
+    results_consolidation_delete_concurrency = 16
+    results_backend = "queue"
+    results_stream_key = "results-stream"
+    results_stream_group = "consolidators"
+    results_stream_batch_size = 1000
+    results_stream_consolidation_size = 100000
     job_status_key_prefix = "task-status-"
+    job_status_index_key_prefix = "job-status-index:"
     job_status_queue_name = ""
     job_status_queue_sas_token = ""
+    job_status_pack_max_count = 1
+    job_status_pack_max_bytes = 65536
+    job_status_pack_max_delay_sec = 1
     workload_tracker_queue_name = "workloadstatus"
     workload_tracker_sas_token = ""
 
@@ -1,6 +1,7 @@
 #include <iostream>
 #include <string>
 #include <chrono>
+#include <cstddef>
 
 std::string DEFAULT_JOB_ID = "UNKNOWN";
 int DEFAULT_DURATION = 10;
@@ -25,6 +26,31 @@ double process(std::string job_id, int duration) {
   return elapsed_time;
 }
 
+/*
+* Kernel that bursts the CPU over a record buffer for duration_sec seconds without printing, so it can be called
+* in-process from Python through ctypes (see app/nativekernel.py), which releases the GIL for the call.
+* Returns the elapsed time in seconds.
+*/
+extern "C" double process_buffer(const char *buffer, size_t length, double duration_sec) {
+  using namespace std::chrono;
+
+  steady_clock::time_point start = steady_clock::now();
+  double elapsed_time = 0;
+  volatile unsigned int checksum = 0;
+
+  while (elapsed_time < duration_sec) {
+    // fold the record into a checksum, the checksum is volatile so the work is not optimized away
+    for (size_t i = 0; i < length; i++) {
+      checksum = checksum * 31 + (unsigned char)buffer[i];
+    }
+    checksum = checksum * 31;
+
+    elapsed_time = duration_cast<duration<double> >(steady_clock::now() - start).count();
+  }
+
+  return elapsed_time;
+}
+
 /*
 * CPP program that bursts the CPU for some amount of time.
 * The first argument to the program is job id (default is "UNKNOWN")
@@ -0,0 +1,111 @@
+"""
+Datafilecache.py reads records that were enqueued by reference. A reference is the blob name of the encrypted data file
+plus the byte offset and length of the record. Records are read from a local copy of the data file that is downloaded
+once and memory-mapped, or with ranged reads against the blob.
+
+module deps:
+pip install azure-storage
+"""
+import mmap
+import os
+import tempfile
+from azure.storage.blob import BlockBlobService
+from config import Config
+
+class DataFileCache(object):
+    """
+    Resolves record references to the encrypted records
+    """
+    def __init__(self, logger):
+        """
+        Initializes a new instance of the DataFileCache class.
+
+        :param logger logger: The logger instance to use for logging
+        """
+        self.logger = logger
+        self.config = Config()
+        self.create_storage_clients()
+        self.data_files = {}
+
+    def create_storage_clients(self):
+        """
+        Creates the blob service client. A forked process creates it again, so it does not share the HTTP connections
+        of its parent.
+        """
+        self.blob_service = BlockBlobService(account_name=self.config.storage_account_name,
+                                             sas_token=self.config.encrypted_files_sas_token)
+
+    def get_local_path(self, blob_name):
+        """
+        :param str blob_name: Name of the data file blob
+        :return: path of the local copy of the data file
+        :rtype: str
+        """
+        return os.path.join(self.config.encrypted_files_folder, os.path.basename(blob_name))
+
+    def download(self, blob_name, local_path):
+        """
+        Downloads a data file blob. The blob is downloaded to a temporary file that is renamed once complete, so
+        processes on the same VM never map a partially downloaded file.
+
+        :param str blob_name: Name of the data file blob
+        :param str local_path: Path to save the data file to
+        """
+        self.logger.info('Downloading data file %s to %s', blob_name, local_path)
+        if not os.path.exists(self.config.encrypted_files_folder):
+            os.makedirs(self.config.encrypted_files_folder)
+
+        handle, temp_path = tempfile.mkstemp(dir=self.config.encrypted_files_folder)
+        os.close(handle)
+        try:
+            self.blob_service.get_blob_to_path(container_name=self.config.storage_container_name,
+                                               blob_name=blob_name,
+                                               file_path=temp_path)
+            os.rename(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_data_file(self, blob_name):
+        """
+        Gets the memory-mapped local copy of a data file, downloading it first if needed.
+
+        :param str blob_name: Name of the data file blob
+        :return: memory-mapped data file
+        :rtype: mmap
+        """
+        data_file = self.data_files.get(blob_name)
+        if data_file is None:
+            local_path = self.get_local_path(blob_name)
+            if not os.path.exists(local_path):
+                self.download(blob_name, local_path)
+
+            with open(local_path, 'rb') as local_file:
+                data_file = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data_files[blob_name] = data_file
+
+        return data_file
+
+    def read(self, blob_name, offset, length):
+        """
+        Reads a record from a data file.
+
+        :param str blob_name: Name of the data file blob
+        :param int offset: Byte offset of the record in the data file
+        :param int length: Length of the record in bytes
+        :return: the encrypted record
+        :rtype: str
+        """
+        if self.config.data_reference_read_mode == 'range':
+            return self.blob_service.get_blob_to_bytes(self.config.storage_container_name, blob_name,
+                                                       start_range=offset, end_range=offset + length - 1).content
+
+        return self.get_data_file(blob_name)[offset:offset + length]
+
+    def close(self):
+        """
+        Unmaps all data files.
+        """
+        for data_file in self.data_files.values():
+            data_file.close()
+        self.data_files = {}
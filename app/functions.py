@@ -2,15 +2,14 @@
   Functions that will be executed by the jobs
 """
 import base64
-import os
 import logging
 import socket
 import sys
-from datetime import datetime
-from aescipher import AESCipher
-from jobstatus import JobStatus, JobState
-from results import Results
+import nativekernel
+from jobstatus import JobState, batch_job_status_id
 from rq import get_current_job
+from workerresources import get_worker_resources
+from workloadprofiles import get_record_profile_name
 
 LOGGER = logging.getLogger(__name__)
 
@@ -35,37 +34,125 @@ def multiply_by_two(x):
 
     return x * 2
 
-def _create_aes_cipher():
+def _process_record(resources, encryptedRecord):
     """
-    Get the environment variables set for the AES Key from the job processor
-    and construct the AESCipher
-    :return: an AESCipher created from the AES key and IV set by the parent process
+    Decrypts a single record and performs the processing task on it
+    :param WorkerResources resources: the worker resources of this process
+    :param object encryptedRecord: This is the encrypted record to be processed, or a reference to it
+    :return: the processed record
     """
-    return AESCipher(os.environ['AES_SECRET'], int(os.environ['AES_IV_LENGTH']))
+    # records enqueued by reference are read from the data file
+    if isinstance(encryptedRecord, tuple):
+        encryptedRecord = resources.data_file_cache.read(*encryptedRecord)
+
+    # decrypt the data to be processed, and decompress it when it was compressed
+    record = resources.payload_compressor.decode(resources.aes_cipher.decrypt(base64.b64decode(encryptedRecord)))
+
+    # run the synthetic workload of the profile the record was generated for, or of the configured profile
+    profile_name = get_record_profile_name(record) or resources.workload_profile_name
+    if profile_name:
+        resources.get_workload_profile(profile_name).run(record)
+    else:
+        # simulate a CPU intensive process, the native kernel runs without holding the GIL
+        nativekernel.process_record(record, resources.processing_duration_sec)
+
+    return record
+
+def _complete_record(resources, job, jobStatusId, record):
+    """
+    Writes the result of a processed record and marks its job status record done, on the result pipeline
+    threads when the worker runs one
+    :param WorkerResources resources: the worker resources of this process
+    :param Job job: the job the record belongs to
+    :param str jobStatusId: id of the job status record of the record
+    :param str record: the processed record
+    """
+    if resources.result_pipeline is not None:
+        resources.result_pipeline.submit(job, jobStatusId, record)
+        return
+
+    if resources.results.result_packer is not None:
+        # the result is written with its packed message, the record is marked done once that is sent
+        resources.jobstatus.update_job_status(jobStatusId, JobState.processed)
+        resources.results.write_result(record, resources.result_completion.callback(job, jobStatusId), jobStatusId)
+        return
+
+    # write out the results, a record whose result was not written fails and keeps its job status record
+    if not resources.results.write_result(record, resultId=jobStatusId):
+        raise Exception("Writing the result of record " + jobStatusId + " failed.")
+
+    # update the job status record
+    resources.jobstatus.update_job_status(jobStatusId, JobState.done)
+
+def _flush_results(resources, job):
+    """
+    Waits for the results the result pipeline is writing for the job, then writes the packed results buffered by the
+    job, and its buffered job status records when it runs in a work horse that exits after the job. A persistent worker
+    keeps packing job status records across jobs.
+    Raises when a result of the job could not be written, so the job fails and is requeued rather than reported
+    finished.
+    :param WorkerResources resources: the worker resources of this process
+    :param Job job: the job
+    """
+    handed = True
+    if resources.result_pipeline is not None:
+        handed = resources.result_pipeline.wait()
+
+    try:
+        # records are completed once their results are written, so their job status records are flushed last
+        flushed = resources.results.flush_results()
+    finally:
+        if not resources.persistent:
+            resources.jobstatus.flush_job_statuses()
+
+    failed = resources.result_completion.take_failures(job)
+    if not handed or not flushed or failed:
+        raise Exception("Writing the results of job {0} failed, records: {1}".format(job.id, ', '.join(failed)))
 
 def processing_job(encryptedRecord, redisHost, redisPort):
     """
     This will decrypt the data and perform some task
-    :param object encryptedRecord: This is the encrypted record to be processed
+    :param object encryptedRecord: This is the encrypted record to be processed, or a
+        (data file blob name, byte offset, length) reference to it
     """
-    # get the current job to process and create the aes cipher
+    # get the current job to process and the cipher and clients of this worker process
     job = get_current_job()
-    aes_cipher = _create_aes_cipher()
+    resources = get_worker_resources(LOGGER, redisHost, redisPort)
 
-    # decrypt the data to be processed
-    record = aes_cipher.decrypt(base64.b64decode(encryptedRecord))
+    record = _process_record(resources, encryptedRecord)
+    _complete_record(resources, job, job.id, record)
+    _flush_results(resources, job)
 
-    # similuate CPU intensive process for 1 second
-    start = datetime.utcnow()
-    while True:
-        runtime = datetime.utcnow() - start
-        if(runtime.seconds > 1):
-            break
+def processing_job_batch(encryptedRecords, redisHost, redisPort):
+    """
+    This will decrypt and perform some task on each record of a batch. Every record has its own job status
+    record and result, so a record that fails does not affect the other records in the batch.
+    :param list encryptedRecords: The encrypted records to be processed, or references to them
+    """
+    # get the current job to process and the cipher and clients of this worker process
+    job = get_current_job()
+    resources = get_worker_resources(LOGGER, redisHost, redisPort)
+    jobstatus = resources.jobstatus
 
-    # write out the results
-    results = Results(LOGGER, redisHost, redisPort)
-    results.write_result(record)
+    failed = 0
+    for index, encryptedRecord in enumerate(encryptedRecords):
+        record_id = batch_job_status_id(job.id, index)
 
-    # update the job status record
-    jobstatus = JobStatus(LOGGER, redisHost, redisPort)
-    jobstatus.update_job_status(job.id, JobState.done)
+        # records completed by an earlier attempt of this job no longer have a job status record, redis errors fail the
+        # job so its records are not skipped
+        if not jobstatus.job_status_exists(record_id):
+            continue
+
+        try:
+            record = _process_record(resources, encryptedRecord)
+            _complete_record(resources, job, record_id, record)
+        except Exception as ex:
+            # leave the job status record in place so the record is processed when the job is requeued
+            LOGGER.error("Record %s failed: %s", record_id, ex)
+            failed += 1
+
+    _flush_results(resources, job)
+
+    # fail the job so it lands in the failed queue and gets requeued for the records that did not complete
+    if failed > 0:
+        raise Exception("{0} of {1} records failed in job {2}".format(failed, len(encryptedRecords), job.id))
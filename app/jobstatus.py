@@ -1,9 +1,13 @@
+import base64
+import calendar
 import pickle
 import redis
+import struct
 from datetime import datetime
 from enum import IntEnum
 from azure.storage.queue import QueueService, models
 from config import Config
+from messagepacker import MessagePacker
 
 class JobState(IntEnum):
     none = 0
@@ -13,10 +17,93 @@ class JobState(IntEnum):
     done = 4
     failed = 5
 
+def batch_job_status_id(jobId, index):
+    """
+    Builds the job status id of a single record in a job that processes a batch of records.
+
+    :param str jobId: Id for the job.
+    :param int index: Position of the record in the batch.
+    :return: Id for the job status record of the record.
+    :rtype: str
+    """
+    return "{0}.{1}".format(jobId, index)
+
+def to_epoch_ms(value):
+    """
+    :param datetime value: a UTC time
+    :return: milliseconds since the epoch
+    :rtype: int
+    """
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+def from_epoch_ms(value):
+    """
+    :param str value: milliseconds since the epoch
+    :return: the UTC time
+    :rtype: datetime
+    """
+    return datetime.utcfromtimestamp(int(value) / 1000.0)
+
+# States of the records that are indexed, records that are done or failed are removed
+ACTIVE_JOB_STATES = (JobState.queued, JobState.processing, JobState.processed)
+
+# Sets the fields of the job status hash KEYS[1] to the ARGV[3] and on field and value pairs when the record exists, so
+# an update does not bring back a record that was completed and removed. Moves the job id ARGV[1] to the index KEYS[2]
+# of the new state, scored by the transition time ARGV[2], out of the indexes KEYS[3] and on of the other states.
+# Returns 1 when the record was updated.
+UPDATE_JOB_STATUS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HMSET', KEYS[1], unpack(ARGV, 3))
+for i = 3, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+# Reads and removes the job status hash KEYS[1] and removes the job id ARGV[1] from the state indexes KEYS[2] and on,
+# returns the fields and values of the hash
+COMPLETE_JOB_STATUS_SCRIPT = """
+local fields = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+return fields
+"""
+
+# Adds the job id ARGV[1] of the job status hash KEYS[1] to the index of its state, KEYS[i] is the index of the state
+# ARGV[i], scored by the time the record was last updated. Returns 1 when the record was indexed.
+INDEX_JOB_STATUS_SCRIPT = """
+local record = redis.call('HMGET', KEYS[1], 'state', 'updated', 'created')
+for i = 2, #KEYS do
+    if record[1] == ARGV[i] then
+        redis.call('ZADD', KEYS[i], record[2] or record[3] or 0, ARGV[1])
+        return 1
+    end
+end
+return 0
+"""
+
+# Binary job status record, version 1: the version, the state, the created and updated times as epoch milliseconds
+# (-1 when not set), and the lengths of the name, the id and the error (NO_ERROR when not set), followed by the UTF-8
+# name, id and error.
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct('>BBqqHHI')
+NO_TIME = -1
+NO_ERROR = 0xFFFFFFFF
+
+def _encode_text(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
 class JobStatusRecord(object):
     """
     Custom object to track a single job's status
     """
+    __slots__ = ('job_name', 'job_id', 'job_state', 'created', 'last_updated', 'last_error')
+
     def __init__(self):
         """
         Initializes a new instance of the JobStatusRecord custom object.
@@ -28,6 +115,120 @@ class JobStatusRecord(object):
         self.last_updated = None
         self.last_error = None
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        # records pickled before the record had slots hold the same attributes in their __dict__ state
+        self.__init__()
+        for name, value in state.items():
+            if name in self.__slots__:
+                setattr(self, name, value)
+
+    def to_hash(self):
+        """
+        Encodes the record as the fields of its job status hash, the state as an int and the times as epoch milliseconds.
+
+        :return: the hash fields
+        :rtype: dict
+        """
+        fields = {'name': self.job_name, 'id': self.job_id, 'state': int(self.job_state)}
+        if self.created is not None:
+            fields['created'] = to_epoch_ms(self.created)
+        if self.last_updated is not None:
+            fields['updated'] = to_epoch_ms(self.last_updated)
+        if self.last_error is not None:
+            fields['error'] = self.last_error
+        return fields
+
+    @staticmethod
+    def from_hash(fields):
+        """
+        Decodes a record from the fields of its job status hash.
+
+        :param dict fields: the hash fields
+        :return: the record, None when the hash is empty
+        :rtype: JobStatusRecord or None
+        """
+        if not fields:
+            return None
+
+        record = JobStatusRecord()
+        record.job_name = fields.get('name', '')
+        record.job_id = fields.get('id', '')
+        record.job_state = int(fields.get('state', JobState.none))
+        record.created = from_epoch_ms(fields['created']) if 'created' in fields else None
+        record.last_updated = from_epoch_ms(fields['updated']) if 'updated' in fields else None
+        record.last_error = fields.get('error')
+        return record
+
+    def encode(self):
+        """
+        Encodes the record in the binary record layout.
+
+        :return: the encoded record
+        :rtype: str
+        """
+        name = _encode_text(self.job_name)
+        job_id = _encode_text(self.job_id)
+        error = _encode_text(self.last_error) if self.last_error is not None else ''
+        return RECORD_HEADER.pack(RECORD_VERSION, int(self.job_state),
+            to_epoch_ms(self.created) if self.created is not None else NO_TIME,
+            to_epoch_ms(self.last_updated) if self.last_updated is not None else NO_TIME,
+            len(name), len(job_id), len(error) if self.last_error is not None else NO_ERROR) + name + job_id + error
+
+    @staticmethod
+    def decode(data):
+        """
+        Decodes a record encoded in the binary record layout.
+
+        :param str data: the encoded record
+        :return: the record
+        :rtype: JobStatusRecord
+        """
+        version, state, created, updated, name_length, id_length, error_length = RECORD_HEADER.unpack_from(data)
+        if version != RECORD_VERSION:
+            raise Exception("Unknown job status record version {0}".format(version))
+
+        record = JobStatusRecord()
+        offset = RECORD_HEADER.size
+        record.job_name = data[offset:offset + name_length]
+        offset += name_length
+        record.job_id = data[offset:offset + id_length]
+        offset += id_length
+        if error_length != NO_ERROR:
+            record.last_error = data[offset:offset + error_length]
+        record.job_state = state
+        record.created = from_epoch_ms(created) if created != NO_TIME else None
+        record.last_updated = from_epoch_ms(updated) if updated != NO_TIME else None
+        return record
+
+def decode_job_status_message(content):
+    """
+    Decodes a job status queue message.
+
+    :param str content: content of a message of the job status queue, a base64 encoded binary record, or a pickled
+        record queued by earlier versions
+    :return: the record
+    :rtype: JobStatusRecord
+    """
+    if content.startswith('ccopy_reg'):
+        return pickle.loads(content)
+    return JobStatusRecord.decode(base64.b64decode(content))
+
+def decode_job_status_messages(content):
+    """
+    Decodes a job status queue message that may hold many packed records.
+
+    :param str content: content of a message of the job status queue, base64 encoded binary records one per line, or
+        a pickled record queued by earlier versions
+    :return: the records
+    :rtype: list
+    """
+    if content.startswith('ccopy_reg'):
+        return [pickle.loads(content)]
+    return [JobStatusRecord.decode(base64.b64decode(line)) for line in content.split('\n') if line]
+
 class JobStatus(object):
     """
     Class for managing job status records.
@@ -60,21 +261,38 @@ class JobStatus(object):
             # creates instance of Redis client to use for job status storage
             pool = redis.ConnectionPool(host=self.redis_host, port=self.redis_port)
             self.storage_service_cache = redis.Redis(connection_pool=pool)
+            self.update_job_status_script = self.storage_service_cache.register_script(UPDATE_JOB_STATUS_SCRIPT)
+            self.complete_job_status_script = self.storage_service_cache.register_script(COMPLETE_JOB_STATUS_SCRIPT)
+            self.index_job_status_script = self.storage_service_cache.register_script(INDEX_JOB_STATUS_SCRIPT)
 
-            # creates instance of QueueService to use for completed job status storage
-            self.storage_service_queue = QueueService(account_name = self.config.storage_account_name,
-                sas_token = self.config.job_status_queue_sas_token)
+            self.create_storage_clients()
 
-            # set the encode function for objects stored as queue message to noencode, serialization will be handled as a string by pickle
-            # http://azure-storage.readthedocs.io/en/latest/ref/azure.storage.queue.queueservice.html
-            # http://azure-storage.readthedocs.io/en/latest/_modules/azure/storage/queue/models.html
-            self.storage_service_queue.encode_function = models.QueueMessageFormat.noencode
+            # packs many completed records into each job status queue message, one record per line
+            self.status_packer = None
+            if self.config.job_status_pack_max_count > 1:
+                self.status_packer = MessagePacker(self.logger, self._put_job_status_message,
+                    self.config.job_status_pack_max_bytes, self.config.job_status_pack_max_count,
+                    self.config.job_status_pack_max_delay_sec)
 
             return True
         except Exception as ex:
             self.log_exception(ex, self.init_storage_services.__name__)
             return False
 
+    def create_storage_clients(self):
+        """
+        Creates the storage service clients. A forked process creates them again, so it does not share the HTTP
+        connections of its parent.
+        """
+        # creates instance of QueueService to use for completed job status storage
+        self.storage_service_queue = QueueService(account_name = self.config.storage_account_name,
+            sas_token = self.config.job_status_queue_sas_token)
+
+        # set the encode function for objects stored as queue message to noencode, records are queued base64 encoded
+        # http://azure-storage.readthedocs.io/en/latest/ref/azure.storage.queue.queueservice.html
+        # http://azure-storage.readthedocs.io/en/latest/_modules/azure/storage/queue/models.html
+        self.storage_service_queue.encode_function = models.QueueMessageFormat.noencode
+
     def init_storage(self):
         """
         Initializes storage table & queue, creating it if it doesn't exist.
@@ -100,13 +318,24 @@ class JobStatus(object):
         self.logger.debug(type(exception))
         self.logger.debug(exception)
 
-    def add_job_status(self, jobName, jobId, jobState):
+    def get_index_key(self, jobState):
+        """
+        :param JobState jobState: a state of active records
+        :return: Redis key of the sorted set of the ids of the records in the state, scored by their last transition
+            time in epoch milliseconds
+        :rtype: str
+        """
+        return self.config.job_status_index_key_prefix + JobState(jobState).name
+
+    def add_job_status(self, jobName, jobId, jobState, pipeline = None):
         """
         Adds a new job status record.
 
         :param str jobName: The name of the job, this will be used as the partition key for the table.
         :param str jobId: Id for the job.
         :param JobState jobState: Enum for the current job state.
+        :param pipeline: Optional redis pipeline to add the write to, the caller is responsible for executing it.
+        :type pipeline: Pipeline or None
         :return: True on succeess. False on failure.
         :rtype: boolean
         """
@@ -116,16 +345,34 @@ class JobStatus(object):
         record.created = datetime.utcnow()
         record.job_state = int(jobState)
         try:
-            # serialize the JobStatusRecord
-            jobStatusSerialized = pickle.dumps(record)
-
-            # write the serialized record out to Redis
-            self.storage_service_cache.set(self.config.job_status_key_prefix + jobId, jobStatusSerialized)
+            # write the record out to Redis as a hash and index it, replacing the record of an earlier attempt
+            key = self.config.job_status_key_prefix + jobId
+            fields = record.to_hash()
+            storage = pipeline if pipeline is not None else self.storage_service_cache.pipeline()
+            storage.delete(key)
+            storage.hmset(key, fields)
+            for state in ACTIVE_JOB_STATES:
+                if state != jobState:
+                    storage.zrem(self.get_index_key(state), jobId)
+            storage.execute_command('ZADD', self.get_index_key(jobState), fields['created'], jobId)
+            if pipeline is None:
+                storage.execute()
             return True
         except Exception as ex:
             self.log_exception(ex, self.add_job_status.__name__)
             return False
 
+    def job_status_exists(self, jobId):
+        """
+        Checks whether a job status record exists. Unlike get_job_status, Redis errors are raised, so a failed check is
+        not mistaken for a completed record.
+
+        :param str jobId: Id for the job.
+        :return: True when the record exists.
+        :rtype: boolean
+        """
+        return bool(self.storage_service_cache.exists(self.config.job_status_key_prefix + jobId))
+
     def get_job_status(self, jobId):
         """
         Gets a job status record from storage.
@@ -135,18 +382,106 @@ class JobStatus(object):
         :rtype: JobStatusRecord or None
         """
         try:
-            # get the serialized job status record from Redis
-            serializedRecord = self.storage_service_cache.get(self.config.job_status_key_prefix + jobId)
-
-            # deserialize the record and return the JobStatusRecord object
-            return pickle.loads(serializedRecord)
+            key = self.config.job_status_key_prefix + jobId
+            try:
+                return JobStatusRecord.from_hash(self.storage_service_cache.hgetall(key))
+            except redis.exceptions.ResponseError:
+                # a pickled record written before job status records were hashes
+                return self.migrate_job_status(key)
         except Exception as ex:
             self.log_exception(ex, self.get_job_status.__name__)
             return None
 
+    def get_job_statuses(self, keys, batchSize = 1000):
+        """
+        Gets many job status records with pipelined reads.
+
+        :param list keys: Redis keys of the job status records.
+        :param int batchSize: Number of records read per round trip.
+        :return: generator of the JobStatusRecord records, records that no longer exist are skipped.
+        """
+        for start in xrange(0, len(keys), batchSize):
+            batch = keys[start:start + batchSize]
+            pipeline = self.storage_service_cache.pipeline(transaction=False)
+            for key in batch:
+                pipeline.hgetall(key)
+
+            for key, fields in zip(batch, pipeline.execute(raise_on_error=False)):
+                if isinstance(fields, redis.exceptions.ResponseError):
+                    record = self.migrate_job_status(key)
+                else:
+                    record = JobStatusRecord.from_hash(fields)
+                if record is not None:
+                    yield record
+
+    def count_active_job_statuses(self):
+        """
+        Counts the active job status records with the state indexes.
+
+        :return: number of queued, processing and processed records.
+        :rtype: int
+        """
+        pipeline = self.storage_service_cache.pipeline(transaction=False)
+        for state in ACTIVE_JOB_STATES:
+            pipeline.zcard(self.get_index_key(state))
+        return sum(pipeline.execute())
+
+    def get_stalled_job_statuses(self, jobStates, maxAgeSec):
+        """
+        Gets the job status records that have been in a state for longer than maxAgeSec seconds with a range query of
+        the state indexes.
+
+        :param list jobStates: the active states to look for.
+        :param int maxAgeSec: number of seconds since the last transition of the records.
+        :return: generator of the JobStatusRecord records.
+        """
+        cutoff = to_epoch_ms(datetime.utcnow()) - maxAgeSec * 1000
+        keys = []
+        for state in jobStates:
+            jobIds = self.storage_service_cache.zrangebyscore(self.get_index_key(state), '-inf', cutoff)
+            keys.extend(self.config.job_status_key_prefix + jobId for jobId in jobIds)
+        return self.get_job_statuses(keys)
+
+    def _get_transition(self, jobId, jobState, updated, error):
+        """
+        Builds the script call of a state transition. Done and failed records are read and removed with the complete
+        script, the other states are written with the update script.
+
+        :return: tuple of the script, its keys and its args
+        """
+        key = self.config.job_status_key_prefix + jobId
+        index_keys = [self.get_index_key(state) for state in ACTIVE_JOB_STATES if state != jobState]
+        if(jobState is JobState.done or jobState is JobState.failed):
+            return self.complete_job_status_script, [key] + index_keys, [jobId]
+
+        args = [jobId, to_epoch_ms(updated), 'state', int(jobState), 'updated', to_epoch_ms(updated)]
+        if(error is not None):
+            args.extend(['error', error])
+        return self.update_job_status_script, [key, self.get_index_key(jobState)] + index_keys, args
+
+    def _finish_transition(self, jobId, jobState, updated, error, reply):
+        """
+        Queues a completed record, raises when the record did not exist.
+
+        :param reply: the reply of the script call of the transition
+        """
+        if(jobState is JobState.done or jobState is JobState.failed):
+            # the complete script returns the fields of the removed record, write it out to the queue
+            record = JobStatusRecord.from_hash(dict(zip(reply[::2], reply[1::2])))
+            if record is None:
+                raise Exception("Job status record " + jobId + " does not exist.")
+            record.job_id = jobId
+            record.job_state = int(jobState)
+            record.last_updated = updated
+            if(error is not None):
+                record.last_error = error
+            self.queue_job_status(record)
+        elif not reply:
+            raise Exception("Job status record " + jobId + " does not exist.")
+
     def update_job_status(self, jobId, jobState, error = None):
         """
-        Updates a job status record.
+        Updates a job status record, only the changed fields are written.
 
         :param str jobId: Id for the job.
         :param JobState jobState: Enum for the current job state.
@@ -155,41 +490,173 @@ class JobStatus(object):
         :return: True on succeess. False on failure.
         :rtype: boolean
         """
-        record = self.get_job_status(jobId)
-        record.job_id = jobId
-        record.last_updated = datetime.utcnow()
-        record.job_state = int(jobState)
-        if(error is not None):
-            record.last_error = error
+        updated = datetime.utcnow()
         try:
-            # serialize the JobStatusRecord
-            jobStatusSerialized = pickle.dumps(record)
-
-            # write the job status record out to storage
-            self.storage_service_cache.set(self.config.job_status_key_prefix + jobId, jobStatusSerialized)
-
             # if the job is complete or failed, write it out to the queue and remove it from the job status collection
-            if(jobState is JobState.done or jobState is JobState.failed):
-                self.queue_job_status(record)
-                self.storage_service_cache.delete(self.config.job_status_key_prefix + jobId)
+            script, keys, args = self._get_transition(jobId, jobState, updated, error)
+            try:
+                reply = script(keys=keys, args=args)
+            except redis.exceptions.ResponseError:
+                # a pickled record written before job status records were hashes
+                self.migrate_job_status(keys[0])
+                reply = script(keys=keys, args=args)
 
+            self._finish_transition(jobId, jobState, updated, error, reply)
             return True
         except Exception as ex:
             self.log_exception(ex, self.update_job_status.__name__)
             return False
 
+    def update_job_statuses(self, jobIds, jobState, error = None):
+        """
+        Updates many job status records to the same state, with the script calls of all records in a single pipeline.
+
+        :param list jobIds: Ids for the jobs.
+        :param JobState jobState: Enum for the new job state.
+        :param error: Optional parameter to provide error details for failed state.
+        :type error: str or None
+        :return: Ids of the records that could not be updated.
+        :rtype: list
+        """
+        updated = datetime.utcnow()
+        try:
+            pipeline = self.storage_service_cache.pipeline(transaction=False)
+            for jobId in jobIds:
+                script, keys, args = self._get_transition(jobId, jobState, updated, error)
+                script(keys=keys, args=args, client=pipeline)
+            replies = pipeline.execute(raise_on_error=False)
+        except Exception as ex:
+            self.log_exception(ex, self.update_job_statuses.__name__)
+            return list(jobIds)
+
+        failed = []
+        for jobId, reply in zip(jobIds, replies):
+            if isinstance(reply, redis.exceptions.ResponseError):
+                # a pickled record written before job status records were hashes, migrated by a single update
+                if not self.update_job_status(jobId, jobState, error):
+                    failed.append(jobId)
+                continue
+
+            try:
+                self._finish_transition(jobId, jobState, updated, error, reply)
+            except Exception as ex:
+                self.log_exception(ex, self.update_job_statuses.__name__)
+                failed.append(jobId)
+        return failed
+
+    def migrate_job_status(self, key):
+        """
+        Rewrites a pickled job status record as a hash and indexes it.
+
+        :param str key: Redis key of the job status record.
+        :return: JobStatusRecord record, None when the key holds no pickled record.
+        :rtype: JobStatusRecord or None
+        """
+        serializedRecord = self.storage_service_cache.get(key)
+        if serializedRecord is None:
+            return None
+
+        record = pickle.loads(serializedRecord)
+        # replace the pickled value only if no other writer changed it meanwhile
+        with self.storage_service_cache.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                if pipeline.get(key) == serializedRecord:
+                    pipeline.multi()
+                    pipeline.delete(key)
+                    pipeline.hmset(key, record.to_hash())
+                    if record.job_state in ACTIVE_JOB_STATES:
+                        transitioned = record.last_updated or record.created or datetime.utcnow()
+                        pipeline.execute_command('ZADD', self.get_index_key(record.job_state), to_epoch_ms(transitioned),
+                            key[len(self.config.job_status_key_prefix):])
+                    pipeline.execute()
+            except redis.exceptions.WatchError:
+                pass
+
+        return record
+
+    def migrate_job_statuses(self):
+        """
+        Rewrites all pickled job status records as hashes, and indexes the hash records written before records were
+        indexed by state.
+
+        :return: tuple of the number of migrated records and the number of indexed hash records.
+        """
+        index_keys = [self.get_index_key(state) for state in ACTIVE_JOB_STATES]
+        states = [int(state) for state in ACTIVE_JOB_STATES]
+        migrated = 0
+        indexed = 0
+        pipeline = self.storage_service_cache.pipeline(transaction=False)
+        for key in self.storage_service_cache.scan_iter(self.config.job_status_key_prefix + '*', count=1000):
+            key_type = self.storage_service_cache.type(key)
+            if key_type == 'string':
+                if self.migrate_job_status(key) is not None:
+                    migrated += 1
+            elif key_type == 'hash':
+                jobId = key[len(self.config.job_status_key_prefix):]
+                self.index_job_status_script(keys=[key] + index_keys, args=[jobId] + states, client=pipeline)
+                if len(pipeline) >= 1000:
+                    indexed += sum(pipeline.execute())
+        indexed += sum(pipeline.execute())
+        return migrated, indexed
+
+    def _put_job_status_message(self, message):
+        """
+        Puts a message into the job status queue
+
+        :param str message: one or more encoded records, one per line
+        """
+        self.storage_service_queue.put_message(self.config.job_status_queue_name, message)
+
     def queue_job_status(self, jobStatusRecord):
         """
-        Queues at job status record
+        Queues at job status record, encoded in the binary record layout, decode it with decode_job_status_messages.
+        When records are packed, the record is buffered and queued with the packed message it is part of.
 
-        :param object jobStatus: The job status record to store in the queue message.
+        :param JobStatusRecord jobStatusRecord: The job status record to store in the queue message.
         :return: True on succeess. False on failure.
         :rtype: boolean
         """
         try:
-            jobStatusRecordSerialized = pickle.dumps(jobStatusRecord)
-            self.storage_service_queue.put_message(self.config.job_status_queue_name, jobStatusRecordSerialized)
+            jobStatusRecordSerialized = base64.b64encode(jobStatusRecord.encode())
+            if self.status_packer is not None:
+                self.status_packer.add(jobStatusRecordSerialized,
+                    lambda error: self._requeue_job_status(jobStatusRecord, jobStatusRecordSerialized, error))
+                return True
+
+            self._put_job_status_message(jobStatusRecordSerialized)
             return True
         except Exception as ex:
             self.log_exception(ex, self.queue_job_status.__name__)
-            return False
\ No newline at end of file
+            return False
+
+    def _requeue_job_status(self, jobStatusRecord, jobStatusRecordSerialized, error):
+        """
+        Queues a record of a packed message that could not be sent in a message of its own, the record was already
+        removed from Redis so it would be lost otherwise
+
+        :param JobStatusRecord jobStatusRecord: The job status record.
+        :param str jobStatusRecordSerialized: The encoded record.
+        :param error: The error of sending the packed message, None when it was sent.
+        :type error: str or None
+        """
+        if error is None:
+            return
+
+        try:
+            self._put_job_status_message(jobStatusRecordSerialized)
+        except Exception as ex:
+            self.logger.error("Job status record %s of state %s could not be queued: %s", jobStatusRecord.job_id,
+                int(jobStatusRecord.job_state), ex)
+
+    def flush_job_statuses(self):
+        """
+        Queues the buffered job status records, called when a job or worker finishes
+
+        :return: True on success. False on failure.
+        :rtype: boolean
+        """
+        if self.status_packer is None:
+            return True
+
+        return self.status_packer.flush()
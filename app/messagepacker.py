@@ -0,0 +1,152 @@
+"""
+Messagepacker.py packs many small messages into a single queue message, so writers are not limited by the queue message
+rate.
+"""
+import collections
+import threading
+import traceback
+
+def run_callbacks(logger, callbacks, error):
+    """
+    Reports the outcome of sending messages to their callbacks. A callback is a function called with the error, or a
+    (handler, argument) pair. A handler is called once with the list of the arguments of all its messages and the
+    error, so the messages sent together are handled in bulk.
+
+    :param logger logger: The logger instance to use for logging
+    :param list callbacks: the callbacks of the messages, None for messages without a callback
+    :param str error: the error sending the messages failed with, None when they were sent
+    """
+    handlers = collections.OrderedDict()
+    for callback in callbacks:
+        if callback is None:
+            continue
+        if isinstance(callback, tuple):
+            handlers.setdefault(callback[0], []).append(callback[1])
+            continue
+        try:
+            callback(error)
+        except Exception:
+            logger.error("Packed message callback failed: %s", traceback.format_exc())
+
+    for handler, arguments in handlers.items():
+        try:
+            handler(arguments, error)
+        except Exception:
+            logger.error("Packed message callback failed: %s", traceback.format_exc())
+
+class MessagePacker(object):
+    """
+    Buffers messages and sends them joined by a separator once the packed message would exceed max_bytes, once
+    max_count messages are buffered, or max_delay_sec seconds after the first message was buffered.
+    """
+    def __init__(self, logger, send, max_bytes, max_count, max_delay_sec, separator='\n'):
+        """
+        :param logger logger: The logger instance to use for logging
+        :param function send: called with each packed message, raises when sending fails
+        :param int max_bytes: maximum size of a packed message
+        :param int max_count: maximum number of messages in a packed message
+        :param float max_delay_sec: maximum time a message is buffered, 0 to only send full packed messages
+        :param str separator: separator between the messages, must not occur in the messages
+        """
+        self.logger = logger
+        self.send = send
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_delay_sec = max_delay_sec
+        self.separator = separator
+        self.lock = threading.Lock()
+        # signalled when a packed message taken out of the buffer has been sent
+        self.sent = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.timer = None
+        self.messages = []
+        self.callbacks = []
+        self.size = 0
+
+    def add(self, message, callback=None):
+        """
+        Buffers a message, sends the packed messages when the buffer is full
+
+        :param str message: The message
+        :param function callback: called with None once the packed message was sent, or with the error when sending
+            it failed, or a (handler, argument) pair, see run_callbacks
+        """
+        full = []
+        with self.lock:
+            if self.messages and self.size + len(self.separator) + len(message) > self.max_bytes:
+                full.append(self._take())
+
+            self.size += len(message) + (len(self.separator) if self.messages else 0)
+            self.messages.append(message)
+            self.callbacks.append(callback)
+
+            if len(self.messages) >= self.max_count or self.size >= self.max_bytes:
+                full.append(self._take())
+            elif self.timer is None and self.max_delay_sec > 0:
+                self.timer = threading.Timer(self.max_delay_sec, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+        # send outside of the lock, so other threads keep buffering
+        for messages, callbacks in full:
+            self._send(messages, callbacks)
+
+    def flush(self):
+        """
+        Sends the buffered messages and waits until the packed messages other threads, like the delay timer, are
+        sending are sent, so the callbacks of every message added before have run when it returns
+
+        :return: True on success. False on failure.
+        :rtype: boolean
+        """
+        sent = True
+        with self.lock:
+            taken = self._take() if self.messages else None
+
+        if taken is not None:
+            sent = self._send(*taken)
+
+        with self.lock:
+            while self.in_flight > 0:
+                self.sent.wait()
+        return sent
+
+    def _take(self):
+        """
+        Takes the buffered messages out of the buffer, must be called holding the lock. The taken messages are in flight
+        until _send sent them.
+
+        :return: tuple of the messages and their callbacks
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        taken = (self.messages, self.callbacks)
+        self.messages = []
+        self.callbacks = []
+        self.size = 0
+        self.in_flight += 1
+        return taken
+
+    def _send(self, messages, callbacks):
+        """
+        Sends the messages as a single packed message and reports the outcome to their callbacks
+
+        :return: True on success. False on failure.
+        :rtype: boolean
+        """
+        error = None
+        try:
+            try:
+                self.send(self.separator.join(messages))
+            except Exception:
+                error = traceback.format_exc()
+                self.logger.error("Sending %d packed messages failed: %s", len(messages), error)
+
+            run_callbacks(self.logger, callbacks, error)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.sent.notify_all()
+        return error is None
@@ -0,0 +1,90 @@
+"""
+Binding for the compute kernel in cpp/program.cpp, called in-process through ctypes.
+
+ctypes releases the GIL for the duration of the call, so the kernel does not block the other threads of the worker.
+When the shared library is not built (make -C cpp libprogram.so) the pure-Python kernel is used.
+"""
+import ctypes
+import logging
+import os
+import time
+from config import Config
+
+LOGGER = logging.getLogger(__name__)
+
+# the loaded library, False once loading it failed
+_LIBRARY = None
+
+def get_library_path():
+    """
+    :return: path to the kernel shared library, relative paths are resolved against the app folder
+    :rtype: str
+    """
+    path = Config().processing_kernel_library
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path
+
+def load_library():
+    """
+    Loads the kernel shared library once per process
+
+    :return: the library, None when it is disabled or can not be loaded
+    """
+    global _LIBRARY
+    if _LIBRARY is None:
+        if Config().processing_kernel != 'native':
+            _LIBRARY = False
+        else:
+            path = get_library_path()
+            try:
+                library = ctypes.CDLL(path)
+                library.process_buffer.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_double]
+                library.process_buffer.restype = ctypes.c_double
+                _LIBRARY = library
+            except (OSError, AttributeError) as ex:
+                LOGGER.warning('Could not load the native kernel from %s, using the Python kernel: %s', path, ex)
+                _LIBRARY = False
+
+    return _LIBRARY or None
+
+def is_native():
+    """
+    :return: True when records are processed by the native kernel
+    :rtype: bool
+    """
+    return load_library() is not None
+
+def process_record_python(record, duration_sec):
+    """
+    Pure-Python kernel, bursts the CPU over the record for duration_sec seconds while holding the GIL
+
+    :param str record: the record to process
+    :param float duration_sec: seconds to process the record for
+    :return: the elapsed time in seconds
+    :rtype: float
+    """
+    start = time.time()
+    elapsed_time = 0
+    checksum = 0
+    while elapsed_time < duration_sec:
+        for char in record:
+            checksum = (checksum * 31 + ord(char)) & 0xffffffff
+        elapsed_time = time.time() - start
+
+    return elapsed_time
+
+def process_record(record, duration_sec):
+    """
+    Processes the record with the native kernel when it is available, else with the Python kernel
+
+    :param str record: the record to process
+    :param float duration_sec: seconds to process the record for
+    :return: the elapsed time in seconds
+    :rtype: float
+    """
+    library = load_library()
+    if library is None:
+        return process_record_python(record, duration_sec)
+
+    return library.process_buffer(record, len(record), duration_sec)
@@ -12,10 +12,15 @@ import time
 import sys
 import socket
 import multiprocessing
+import signal
 from config import Config
+from compression import PayloadCompressor
+from resultpipeline import ResultPipeline
 from aescipher import AESCipher
 from aeskeywrapper import AESKeyWrapper
-from rq import Queue, Connection, Worker
+from rq import Queue, Connection
+from workerresources import get_worker_resources
+from workers import RecyclingWorker, TimedWorker
 from workloadTracker import WorkloadTracker, WorkloadEventType
 
 LOGGER = logging.getLogger(__name__)
@@ -24,13 +29,17 @@ class Processor(object):
     """
         Processes Redis Q jobs
     """
-    def __init__(self, logger, redisHost, redisPort, queues, encryptedAESKeyPath):
+    def __init__(self, logger, redisHost, redisPort, queues, encryptedAESKeyPath, workerMode=None, jobTimes=None):
         """
         :param logger logger: the logger
         :param str redis_host: Redis host where the Redis Q is running
         :param int redis_port: Redis port where the Redis Q is running
         :param array queues: the queues the worker will listen on
         :param str encryptedAesKeyPath: path to the encrypted AES key file
+        :param str workerMode: 'fork' forks a work horse per job, 'persistent' runs jobs in a supervised long-lived
+            worker process, 'pipelined' also writes results on background threads while the next jobs are processed,
+            defaults to the config value
+        :param Array jobTimes: shared array the workers add their job times to, see JobTimingMixin
         """
         self.logger = logger
         self.queues = queues
@@ -38,6 +47,8 @@ class Processor(object):
         self.redis_host = redisHost
         self.redis_port = redisPort
         self.encrypted_aes_key_path = encryptedAESKeyPath
+        self.worker_mode = workerMode or self.config.processor_worker_mode
+        self.job_times = jobTimes
 
     def _get_aes_key(self):
         """
@@ -86,10 +97,216 @@ class Processor(object):
                 self.logger.info("Redis isn't running, sleep for 5 seconds.")
                 time.sleep(5)
 
+        if self.worker_mode in ('persistent', 'pipelined'):
+            self.supervise()
+        else:
+            self.work(redis_conn)
+
+    def work(self, redis_conn, worker_class=TimedWorker, **worker_args):
+        """
+        Build the worker resources and work on jobs from the Redis Q
+
+        :param object redis_conn: Redis connection object
+        :param class worker_class: the Redis Q worker class to use
+        :param worker_args: additional arguments for the worker class
+        """
+        # build the cipher and create the containers and queues once, the forked work horses inherit the cipher and
+        # create their own storage clients
+        get_worker_resources(self.logger, self.redis_host, self.redis_port)
+
         with Connection(redis_conn):
-            worker = Worker(self.queues)
+            worker = worker_class(self.queues, job_times=self.job_times,
+                prefetch_count=self.config.processor_prefetch_count,
+                prefetch_sweep_interval_sec=self.config.processor_prefetch_sweep_interval_sec, **worker_args)
             worker.work()
 
+    def work_persistent(self):
+        """
+        Entry point of a supervised persistent worker process
+        """
+        pool = redis.ConnectionPool(host=self.redis_host, port=self.redis_port)
+        redis_conn = redis.Redis(connection_pool=pool)
+
+        resources = get_worker_resources(self.logger, self.redis_host, self.redis_port)
+        resources.persistent = True
+        if self.worker_mode == 'pipelined':
+            resources.result_pipeline = ResultPipeline(self.logger, resources.results, resources.jobstatus,
+                resources.result_completion, self.config.processor_pipeline_window)
+
+        try:
+            self.work(redis_conn, RecyclingWorker,
+                max_jobs=self.config.processor_worker_max_jobs,
+                max_rss_mb=self.config.processor_worker_max_rss_mb)
+        finally:
+            # finish writing the results that are still in flight before the worker process exits
+            if resources.result_pipeline is not None:
+                resources.result_pipeline.drain()
+            resources.results.flush_results()
+            resources.jobstatus.flush_job_statuses()
+
+    def supervise(self):
+        """
+        Runs jobs in a long-lived worker process that is replaced whenever it recycles itself or crashes, so a crashing
+        job only takes down its worker process and not the processor.
+        """
+        # turn SIGTERM into a normal exit so the worker process is stopped with the supervisor
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        worker_process = None
+        try:
+            while True:
+                worker_process = multiprocessing.Process(target=self.work_persistent)
+                worker_process.start()
+                self.logger.info('Started persistent worker process %d', worker_process.pid)
+                worker_process.join()
+
+                if worker_process.exitcode == 0:
+                    self.logger.info('Persistent worker process %d recycled', worker_process.pid)
+                else:
+                    # jobs that were running in a crashed worker are moved to the failed queue by the started job registry
+                    # cleanup and requeued by the validator
+                    self.logger.warning('Persistent worker process %d exited with code %s, restarting in 5 seconds',
+                        worker_process.pid, worker_process.exitcode)
+                    time.sleep(5)
+        finally:
+            if worker_process is not None and worker_process.is_alive():
+                worker_process.terminate()
+                worker_process.join()
+
+class ProcessorSupervisor(object):
+    """
+    Runs the processor processes and scales their number between a minimum and a maximum based on the Redis Q depth,
+    the cpu time the jobs use compared to their wall time, and the host load.
+    """
+    def __init__(self, logger, args):
+        """
+        :param logger logger: the logger
+        :param object args: the parsed command line arguments
+        """
+        self.logger = logger
+        self.config = Config()
+        self.args = args
+        self.processes = []
+        self.cpu_count = multiprocessing.cpu_count()
+        self.min_processes = args.minProcesses if args.minProcesses > 0 else self.cpu_count
+        self.max_processes = max(args.maxProcesses if args.maxProcesses > 0 else self.cpu_count, self.min_processes)
+
+        # [number of jobs, wall seconds, cpu seconds] added to by the workers of all processes
+        self.job_times = multiprocessing.Array('d', 3)
+
+        queues = args.queues.split(',') if isinstance(args.queues, basestring) else args.queues
+        self.redis_conn = redis.Redis(host=args.redisHost, port=args.redisPort)
+        self.queues = [Queue(name, connection=self.redis_conn) for name in queues]
+
+    def start_process(self):
+        """
+        Starts a processor process
+        """
+        process = multiprocessing.Process(target=init, args=(self.args, self.job_times))
+        process.start()
+        self.processes.append(process)
+
+    def stop_process(self):
+        """
+        Stops the most recently started processor process, its worker finishes the current job before it exits
+        """
+        process = self.processes.pop()
+        process.terminate()
+
+    def get_queue_depth(self):
+        """
+        :return: number of jobs waiting in the Redis Q queues, None when redis can not be reached
+        """
+        try:
+            return sum(queue.count for queue in self.queues)
+        except redis.exceptions.ConnectionError:
+            return None
+
+    def read_job_times(self):
+        """
+        Reads and resets the job times recorded since the last call
+
+        :return: tuple of the number of jobs, wall seconds and cpu seconds
+        """
+        with self.job_times.get_lock():
+            job_times = tuple(self.job_times[:])
+            self.job_times[:] = [0.0, 0.0, 0.0]
+
+        return job_times
+
+    def decide(self, current, depth, jobs, wall_sec, cpu_sec, load):
+        """
+        Decides how many processor processes should be running
+
+        :param int current: number of running processes
+        :param int depth: number of jobs waiting in the Redis Q
+        :param float jobs: number of jobs completed since the last decision
+        :param float wall_sec: wall time of those jobs
+        :param float cpu_sec: cpu time of those jobs
+        :param float load: one minute load average per cpu
+        :return: tuple of the target number of processes and the reason for it
+        """
+        cpu_ratio = cpu_sec / wall_sec if jobs > 0 and wall_sec > 0 else None
+        io_bound = cpu_ratio is not None and cpu_ratio < self.config.processor_scale_io_bound_ratio
+
+        if depth == 0:
+            target, reason = self.min_processes, 'queue is empty'
+        elif load >= self.config.processor_scale_max_load:
+            target, reason = current - 1, 'host is overloaded'
+        elif depth > current and (io_bound or current < self.cpu_count):
+            # cpu bound jobs gain from one process per cpu, jobs waiting on I/O gain from more
+            target, reason = current + 1, 'jobs are waiting on I/O' if io_bound else 'cpus are available'
+        elif depth < current:
+            target, reason = current - 1, 'fewer queued jobs than processes'
+        else:
+            target, reason = current, 'no change needed'
+
+        target = max(self.min_processes, min(self.max_processes, target))
+        return target, '{0} (queued jobs: {1}, jobs: {2:.0f}, cpu/wall: {3}, load per cpu: {4:.2f})'.format(
+            reason, depth, jobs, '{0:.2f}'.format(cpu_ratio) if cpu_ratio is not None else 'n/a', load)
+
+    def run(self):
+        """
+        Starts the minimum number of processes and rescales every processor_scale_interval_sec seconds
+        """
+        self.logger.info('Scaling processor processes between {0} and {1}'.format(self.min_processes, self.max_processes))
+        for i in xrange(self.min_processes):
+            self.start_process()
+
+        while True:
+            time.sleep(self.config.processor_scale_interval_sec)
+
+            # replace processes that exited unexpectedly
+            for process in [process for process in self.processes if not process.is_alive()]:
+                self.logger.warning('Processor process {0} exited with code {1}'.format(process.pid, process.exitcode))
+                self.processes.remove(process)
+            while len(self.processes) < self.min_processes:
+                self.start_process()
+
+            if self.min_processes == self.max_processes:
+                continue
+
+            depth = self.get_queue_depth()
+            if depth is None:
+                self.logger.info('Redis is not reachable, keeping {0} processes'.format(len(self.processes)))
+                continue
+
+            jobs, wall_sec, cpu_sec = self.read_job_times()
+            load = os.getloadavg()[0] / self.cpu_count
+            current = len(self.processes)
+            target, reason = self.decide(current, depth, jobs, wall_sec, cpu_sec, load)
+
+            if target > current:
+                self.logger.info('Scaling up from {0} to {1} processes: {2}'.format(current, target, reason))
+                for i in xrange(target - current):
+                    self.start_process()
+            elif target < current:
+                self.logger.info('Scaling down from {0} to {1} processes: {2}'.format(current, target, reason))
+                for i in xrange(current - target):
+                    self.stop_process()
+            else:
+                self.logger.info('Keeping {0} processes: {1}'.format(current, reason))
+
 def init_logging():
     """
     Initialize the logger
@@ -110,13 +327,20 @@ def parse_args():
     parser.add_argument('--queues', help='Redis Q queues to listen on', default=['high', 'default', 'low'])
     parser.add_argument('--redisHost', help='Redis Q host.', default=config.redis_host)
     parser.add_argument('--redisPort', help='Redis Q port.', default=config.redis_port)
+    parser.add_argument('--workerMode', help='fork: fork a work horse per job, persistent: run jobs in a supervised long-lived process, '
+        'pipelined: persistent, and write results while the next jobs are processed.',
+        choices=['fork', 'persistent', 'pipelined'], default=config.processor_worker_mode)
+    parser.add_argument('--minProcesses', help='Minimum number of processor processes, 0 uses one per cpu.',
+        type=int, default=config.processor_min_processes)
+    parser.add_argument('--maxProcesses', help='Maximum number of processor processes, 0 uses one per cpu.',
+        type=int, default=config.processor_max_processes)
 
     return parser.parse_args()
 
-def init(args):
+def init(args, job_times=None):
     LOGGER.info('Running Processor - Fork')
     WORKLOADTRACKER.write(WorkloadEventType.PROCESSOR_FORK_START, 'Running Processor - Fork')
-    PROCESSOR = Processor(LOGGER, args.redisHost, args.redisPort, args.queues, args.aesKeyFilePath)
+    PROCESSOR = Processor(LOGGER, args.redisHost, args.redisPort, args.queues, args.aesKeyFilePath, args.workerMode, job_times)
     PROCESSOR.run()
 
 if __name__ == "__main__":
@@ -130,11 +354,18 @@ if __name__ == "__main__":
     WORKLOADTRACKER.write(WorkloadEventType.PROCESSOR_START, 'Running Processor - Main')
 
     commandLineArgs = parse_args()
-    # Fork process
-    num_process = multiprocessing.cpu_count()
-    LOGGER.info('Lunching {} processing'.format(num_process))
-    for i in xrange(num_process):
-        p = multiprocessing.Process(target=init, args=(commandLineArgs,))
-        p.start()
+
+    # Stop before forking when the configured compression codec is not installed, every job would fail on it
+    CONFIG = Config()
+    try:
+        PayloadCompressor(CONFIG.payload_compression, CONFIG.payload_compression_level)
+    except Exception as ex:
+        LOGGER.error("Cannot start the processor, payload_compression '{0}': {1}. Install lz4 with pip install lz4 and "
+                     "zstd with pip install zstandard".format(CONFIG.payload_compression, ex))
+        sys.exit(1)
+
+    # Fork processes, scaled between the minimum and maximum number of processes
+    SUPERVISOR = ProcessorSupervisor(LOGGER, commandLineArgs)
+    SUPERVISOR.run()
 
 
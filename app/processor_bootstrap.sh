@@ -5,8 +5,21 @@ pip install azure-storage
 pip install azure-keyvault
 pip install cryptography
 pip install rq
+pip install futures
 
 tar -xzf app.tar.gz
 
+# build the native compute kernel, the processor falls back to the Python kernel when it is missing
+make -C app/cpp libprogram.so || echo "Native kernel not built, using the Python kernel"
+
 python app/processorconfiguration.py
+# install the payload compression codec the configuration names, zlib needs no install
+CODEC=$(python -c "import json; print json.load(open('config/config.json')).get('payload_compression', 'none')")
+if [[ $CODEC == lz4 ]]
+then
+    pip install lz4
+elif [[ $CODEC == zstd ]]
+then
+    pip install zstandard
+fi
 python app/processor.py data/aes.encrypted --redisHost $1 --redisPort 6379 2>&1 | python app/queuelogger.py
\ No newline at end of file
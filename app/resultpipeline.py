@@ -0,0 +1,160 @@
+"""
+Resultpipeline.py writes job results and job status updates on background threads, so a worker can decrypt and compute the
+next records while earlier results are still being written to storage.
+
+module deps:
+pip install futures
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from jobstatus import JobState
+
+class ResultCompletion(object):
+    """
+    Marks records done once their result is written. Results that could not be written are recorded for their job,
+    which fails when it finishes so RQ moves it to the failed queue and the validator requeues it.
+    """
+    def __init__(self, logger, jobstatus):
+        """
+        :param logger logger: The logger instance to use for logging
+        :param JobStatus jobstatus: JobStatus used to update the job status records
+        """
+        self.logger = logger
+        self.jobstatus = jobstatus
+        # job id -> ids of the job status records whose result could not be written
+        self.failures = {}
+        self.failures_lock = threading.Lock()
+
+    def callback(self, job, jobStatusId):
+        """
+        :param Job job: The job the record belongs to
+        :param str jobStatusId: Id of the job status record of the record
+        :return: a Results.write_result onWritten callback completing the record, the records whose results are
+            written with the same packed message are completed together
+        """
+        return (self.complete_all, (job, jobStatusId))
+
+    def complete(self, job, jobStatusId, error=None):
+        """
+        Marks the record done, or records the failure for its job when its result could not be written
+
+        :param Job job: The job the record belongs to
+        :param str jobStatusId: Id of the job status record of the record
+        :param str error: the error writing the result failed with, None when it was written
+        """
+        self.complete_all([(job, jobStatusId)], error)
+
+    def complete_all(self, records, error=None):
+        """
+        Marks records done with a single pipelined update, or records the failures for their jobs when their results
+        could not be written
+
+        :param list records: (job, job status id) pairs of the records
+        :param str error: the error writing the results failed with, None when they were written
+        """
+        if error is None:
+            failed = self.jobstatus.update_job_statuses([jobStatusId for job, jobStatusId in records], JobState.done)
+            if failed:
+                self.logger.error("Marking %d records done failed: %s", len(failed), ', '.join(failed))
+            return
+
+        with self.failures_lock:
+            for job, jobStatusId in records:
+                self.logger.error("Writing the result of %s failed: %s", jobStatusId, error)
+                self.failures.setdefault(job.id, []).append(jobStatusId)
+
+    def take_failures(self, job):
+        """
+        Takes the records of a job whose results could not be written
+
+        :param Job job: The job
+        :return: ids of the job status records of the records, empty when all results were written
+        :rtype: list
+        """
+        with self.failures_lock:
+            return self.failures.pop(job.id, [])
+
+class ResultPipeline(object):
+    """
+    Overlaps result and job status I/O with the processing of the next records of a job, with at most window records in
+    flight. The job waits for its records with wait before it finishes.
+    """
+    def __init__(self, logger, results, jobstatus, completion, window):
+        """
+        :param logger logger: The logger instance to use for logging
+        :param Results results: Results used to write the results
+        :param JobStatus jobstatus: JobStatus used to update the job status records
+        :param ResultCompletion completion: completes the records once their results are written
+        :param int window: maximum number of records whose result and job status are being written at the same time
+        """
+        self.logger = logger
+        self.results = results
+        self.jobstatus = jobstatus
+        self.window = window
+        self.executor = ThreadPoolExecutor(max_workers=window)
+        self.in_flight = threading.BoundedSemaphore(window)
+        self.completion = completion
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+    def submit(self, job, jobStatusId, record):
+        """
+        Hands a processed record to the pipeline, blocks while the pipeline window is full.
+
+        :param Job job: The job the record belongs to
+        :param str jobStatusId: Id of the job status record of the record
+        :param str record: The processed record
+        """
+        self.in_flight.acquire()
+        try:
+            future = self.executor.submit(self._complete, job, jobStatusId, record)
+        except Exception:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda completed: self.in_flight.release())
+        with self.pending_lock:
+            self.pending.append(future)
+
+    def _complete(self, job, jobStatusId, record):
+        """
+        Writes the result, the record is marked done once the result is written
+
+        :param Job job: The job the record belongs to
+        :param str jobStatusId: Id of the job status record of the record
+        :param str record: The processed record
+        """
+        # a packed result is only written once its message is sent, mark the record processed meanwhile, the job does
+        # not finish before the message is sent
+        if self.results.result_packer is not None:
+            self.jobstatus.update_job_status(jobStatusId, JobState.processed)
+
+        self.results.write_result(record, self.completion.callback(job, jobStatusId), jobStatusId)
+
+    def wait(self):
+        """
+        Waits until the results of the records submitted so far are handed to the results writer, called before a job
+        finishes. Results still buffered by the writer are written by Results.flush_results.
+
+        :return: True on success. False when handing over a record failed.
+        :rtype: boolean
+        """
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = []
+
+        handed = True
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                self.logger.error("Writing a pipelined result failed: %s", traceback.format_exc())
+                handed = False
+        return handed
+
+    def drain(self):
+        """
+        Waits until all records in the pipeline are handed to the results writer and stops the pipeline threads.
+        Results still buffered by the writer are written by Results.flush_results.
+        """
+        self.executor.shutdown(wait=True)
@@ -1,14 +1,20 @@
 import base64
+import functools
 import redis
+import socket
 import time
 import azure.common
-import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from azure.storage.blob import BlockBlobService, AppendBlobService
 from azure.storage.queue import QueueService, models
 from config import Config
 from aescipher import AESCipher
 from aeshelper import AESHelper
+from compression import PayloadCompressor
+from messagepacker import MessagePacker, run_callbacks
+from resultshards import ResultShards
 
 class Results(object):
     """
@@ -29,6 +35,8 @@ class Results(object):
         # create an instance of AESCipher to use for encryption
         aesHelper = AESHelper(self.config)
         self.aescipher = aesHelper.create_aescipher_from_config()
+        # compresses the results before they are encrypted
+        self.payload_compressor = PayloadCompressor(self.config.payload_compression, self.config.payload_compression_level)
         if(self.init_storage_services() is False):
             raise Exception("Errors occurred instantiating results storage service.")
 
@@ -39,27 +47,49 @@ class Results(object):
         :rtype: boolean
         """
         try:
-            # creates instance of BlockBlobService and AppendBlobService to use for completed results storage
-            self.storage_service = BlockBlobService(account_name = self.config.storage_account_name, sas_token = self.config.results_container_sas_token)
-            self.append_storage_service = AppendBlobService(account_name = self.config.storage_account_name, sas_token = self.config.results_container_sas_token)
+            self.create_storage_clients()
             self.storage_service.create_container(self.config.results_container_name)
-
-            # creates instances of Azure QueueService
-            self.job_status_queue_service = QueueService(account_name = self.config.storage_account_name, sas_token = self.config.job_status_queue_sas_token)
-            self.job_status_queue_service.encode_function = models.QueueMessageFormat.noencode
-            self.results_queue_service = QueueService(account_name = self.config.storage_account_name, sas_token = self.config.results_queue_sas_token)
             self.results_queue_service.create_queue(self.config.results_container_name)
-            self.results_queue_service.encode_function = models.QueueMessageFormat.noencode
+
+            # packs many results into each results queue message, one result per line
+            self.result_packer = None
+            if self.config.results_pack_max_count > 1:
+                self.result_packer = MessagePacker(self.logger, self._put_results_message,
+                    self.config.results_pack_max_bytes, self.config.results_pack_max_count,
+                    self.config.results_pack_max_delay_sec)
 
             # creates instance of Redis client to use for job status storage
             pool = redis.ConnectionPool(host=self.redis_host, port=self.redis_port)
             self.storage_service_cache = redis.Redis(connection_pool=pool)
 
+            # consolidated results are appended to shard blobs
+            self.result_shards = ResultShards(self.logger, self.config, self.append_storage_service, self.storage_service,
+                self.storage_service_cache)
+
             return True
         except Exception as ex:
             self.log_exception(ex, self.init_storage_services.__name__)
             return False
 
+    def create_storage_clients(self):
+        """
+        Creates the storage service clients. A forked process creates them again, so it does not share the HTTP
+        connections of its parent.
+        """
+        # creates instance of BlockBlobService and AppendBlobService to use for completed results storage
+        self.storage_service = BlockBlobService(account_name = self.config.storage_account_name, sas_token = self.config.results_container_sas_token)
+        self.append_storage_service = AppendBlobService(account_name = self.config.storage_account_name, sas_token = self.config.results_container_sas_token)
+
+        # creates instances of Azure QueueService
+        self.job_status_queue_service = QueueService(account_name = self.config.storage_account_name, sas_token = self.config.job_status_queue_sas_token)
+        self.job_status_queue_service.encode_function = models.QueueMessageFormat.noencode
+        self.results_queue_service = QueueService(account_name = self.config.storage_account_name, sas_token = self.config.results_queue_sas_token)
+        self.results_queue_service.encode_function = models.QueueMessageFormat.noencode
+
+        if getattr(self, 'result_shards', None) is not None:
+            self.result_shards.append_storage_service = self.append_storage_service
+            self.result_shards.storage_service = self.storage_service
+
     def log_exception(self, exception, functionName):
         """
         Logs an exception to the logger instance for this class.
@@ -71,26 +101,63 @@ class Results(object):
         self.logger.debug(type(exception))
         self.logger.debug(exception)
 
-    def write_result(self, result):
+    def _put_results_message(self, message):
         """
-        Encrypts and writes result to queue
+        Puts a message into the results queue, or adds it to the results stream when results_backend is redis_stream
+
+        :param str message: one or more encoded results, one per line
+        """
+        if self.config.results_backend == 'redis_stream':
+            self.storage_service_cache.execute_command('XADD', self.config.results_stream_key, '*', 'result', message)
+        else:
+            self.results_queue_service.put_message(self.config.results_queue_name, message)
+
+    def write_result(self, result, onWritten=None, resultId=None):
+        """
+        Encrypts and writes result to queue. When results are packed, the result is buffered and written with the
+        packed message it is part of.
 
         :param str result: The result to write to queue
+        :param function onWritten: called with None once the result is in the queue, or with the error when writing it
+            failed, or a (handler, argument) pair that completes the results of a packed message together, see
+            messagepacker.run_callbacks
+        :param str resultId: id of the record of the result, written before the encoded result separated by a space, so
+            the binary shard indexes are keyed by it
         :return: True on success. False on failure.
         :rtype: boolean
         """
         try:
-            # encrypt the encoded result and then encode it
-            encryptedResult = base64.b64encode(self.aescipher.encrypt(result))
+            # compress and encrypt the result and then encode it
+            encryptedResult = base64.b64encode(self.aescipher.encrypt(self.payload_compressor.encode(result)))
+            if resultId is not None:
+                encryptedResult = resultId + ' ' + encryptedResult
+
+            if self.result_packer is not None:
+                self.result_packer.add(encryptedResult, onWritten)
+                return True
 
             # put the encoded result into the azure queue for future consolidation
-            self.results_queue_service.put_message(self.config.results_queue_name, encryptedResult)
+            self._put_results_message(encryptedResult)
 
+            run_callbacks(self.logger, [onWritten], None)
             return True
         except Exception as ex:
             self.log_exception(ex, self.write_result.__name__)
+            run_callbacks(self.logger, [onWritten], str(ex))
             return False
 
+    def flush_results(self):
+        """
+        Writes the buffered results to queue, called when a job or worker finishes
+
+        :return: True on success. False on failure.
+        :rtype: boolean
+        """
+        if self.result_packer is None:
+            return True
+
+        return self.result_packer.flush()
+
     def count_consolidated_results(self):
         """
         Returns a count of results that were consolidated.
@@ -109,48 +176,185 @@ class Results(object):
 
     def consolidate_results(self):
         """
-        Consolidates all individual result files into single result file in storage. Blobs are deleted once they
-        are added to the consolidated file.
+        Consolidates all individual result messages into the consolidated result shards in storage. Fetching,
+        appending and deleting run as concurrent stages: every fetched batch of messages is appended on the
+        consolidation threads while the next batch is fetched, and its messages are deleted once the append succeeded.
+        Messages of a batch that could not be appended stay in the queue or stream and are consolidated by a later run.
 
         "return: int count: Total count of results consolidated in result file.
         """
+        num_of_consolidated_results = 0
         try:
-            # ensure the consolidated append blob exists
-            if not self.append_storage_service.exists(self.config.results_container_name, blob_name=self.config.results_consolidated_file):
-                self.append_storage_service.create_blob(self.config.results_container_name, self.config.results_consolidated_file)
-
-            result_messages = []
-            with io.BytesIO() as consolidated_result:
-                while len(result_messages) < self.config.result_consolidation_size:
-                    messages = self.results_queue_service.get_messages(self.config.results_queue_name, min(self.config.result_consolidation_size, 32))
-                    
-                    # If the queue is empty, stop and consolidate
-                    if not messages:
+            append_executor = ThreadPoolExecutor(max_workers=self.config.results_consolidation_concurrency)
+            delete_executor = ThreadPoolExecutor(max_workers=self.config.results_consolidation_delete_concurrency)
+            # bounds the fetched batches waiting to be appended
+            in_flight = threading.BoundedSemaphore(self.config.results_consolidation_concurrency)
+            appends = []
+            try:
+                if self.config.results_backend == 'redis_stream':
+                    batches = self._fetch_stream_batches()
+                else:
+                    batches = self._fetch_queue_batches(delete_executor)
+
+                while True:
+                    in_flight.acquire()
+                    try:
+                        batch = next(batches, None)
+                    except Exception:
+                        in_flight.release()
+                        raise
+
+                    # If there are no more results, stop and consolidate
+                    if batch is None:
+                        in_flight.release()
                         break
 
-                    # add the message to the memory stream
-                    for msg in messages:
-                        consolidated_result.write(msg.content+"\n")
-                        result_messages.append(msg)
-            
-                # append the results to the consolidated file
-                consolidated_result.seek(0)
-                self.append_storage_service.append_blob_from_stream(self.config.results_container_name, self.config.results_consolidated_file, consolidated_result)
-
-            # remove all of the messages from the queue
-            num_of_consolidated_results = len(result_messages)
-            for msg in result_messages:
-                self.results_queue_service.delete_message(self.config.results_queue_name, msg.id, msg.pop_receipt)
-            self.storage_service_cache.incrby(self.config.results_consolidated_count_redis_key, num_of_consolidated_results)
+                    contents, on_appended = batch
+                    append = append_executor.submit(self._append_results, contents, on_appended)
+                    append.add_done_callback(lambda completed: in_flight.release())
+                    appends.append(append)
+            finally:
+                # wait for the appends, then for the deletes they submitted
+                for append in appends:
+                    num_of_consolidated_results += append.result()
+                append_executor.shutdown(wait=True)
+                delete_executor.shutdown(wait=True)
+
+            # list the shards and their result counts for readers of the consolidated results
+            if num_of_consolidated_results > 0:
+                self.result_shards.write_manifest()
 
             # write the count of results we consolidated out to queue to provide status
             self.job_status_queue_service.put_message(self.config.job_status_queue_name, str(num_of_consolidated_results) + " results consolidated.")
 
-            return len(result_messages)
+            return num_of_consolidated_results
 
         except Exception as ex:
             self.log_exception(ex, self.consolidate_results.__name__)
-            return len(result_messages)
+            return num_of_consolidated_results
+
+    def _fetch_queue_batches(self, delete_executor):
+        """
+        Fetches up to result_consolidation_size messages from the results queue, in batches of up to 32 messages
+
+        :param ThreadPoolExecutor delete_executor: the executor the appended messages are deleted on
+        :return: generator of tuples of the message contents and the function to call once they are appended
+        """
+        num_of_fetched_messages = 0
+        while num_of_fetched_messages < self.config.result_consolidation_size:
+            messages = self.results_queue_service.get_messages(self.config.results_queue_name, min(self.config.result_consolidation_size, 32))
+            if not messages:
+                break
+
+            num_of_fetched_messages += len(messages)
+            yield [msg.content for msg in messages], functools.partial(self._delete_result_messages, messages, delete_executor)
+
+    def _delete_result_messages(self, messages, delete_executor):
+        """
+        Deletes consolidated result messages from the queue, one call per message on the delete threads
+
+        :param list messages: the result messages
+        :param ThreadPoolExecutor delete_executor: the executor the messages are deleted on
+        """
+        for msg in messages:
+            delete_executor.submit(self._delete_result_message, msg)
+
+    def _delete_result_message(self, msg):
+        """
+        Deletes a consolidated result message from the queue
+
+        :param QueueMessage msg: the result message
+        """
+        try:
+            self.results_queue_service.delete_message(self.config.results_queue_name, msg.id, msg.pop_receipt)
+        except Exception as ex:
+            self.log_exception(ex, self._delete_result_message.__name__)
+
+    def _create_stream_group(self):
+        """
+        Creates the results stream and its consumer group when they do not exist
+        """
+        try:
+            self.storage_service_cache.execute_command('XGROUP', 'CREATE', self.config.results_stream_key,
+                self.config.results_stream_group, '0', 'MKSTREAM')
+        except redis.exceptions.ResponseError as ex:
+            if 'BUSYGROUP' not in str(ex):
+                raise
+
+    def _fetch_stream_batches(self):
+        """
+        Reads up to results_stream_consolidation_size entries from the results stream through the consumer group, in
+        batches of results_stream_batch_size entries. Entries this consumer read before but did not acknowledge, like
+        after a crash, are read first.
+
+        :return: generator of tuples of the entry contents and the function to call once they are appended
+        """
+        self._create_stream_group()
+        consumer = socket.gethostname()
+
+        num_of_fetched_entries = 0
+        last_id = '0'
+        while num_of_fetched_entries < self.config.results_stream_consolidation_size:
+            reply = self.storage_service_cache.execute_command('XREADGROUP', 'GROUP', self.config.results_stream_group,
+                consumer, 'COUNT', self.config.results_stream_batch_size, 'STREAMS', self.config.results_stream_key, last_id)
+            entries = reply[0][1] if reply else []
+
+            if not entries:
+                # switch to new entries once the unacknowledged ones are read
+                if last_id == '>':
+                    break
+                last_id = '>'
+                continue
+            if last_id != '>':
+                last_id = entries[-1][0]
+
+            num_of_fetched_entries += len(entries)
+            ids = [entry_id for entry_id, fields in entries]
+            # entries deleted while they were pending have no fields, they are only acknowledged
+            contents = [fields[1] for entry_id, fields in entries if fields]
+            yield contents, functools.partial(self._ack_stream_entries, ids)
+
+    def _ack_stream_entries(self, ids):
+        """
+        Acknowledges and deletes consolidated results stream entries in bulk
+
+        :param list ids: the entry ids
+        """
+        try:
+            pipeline = self.storage_service_cache.pipeline()
+            pipeline.execute_command('XACK', self.config.results_stream_key, self.config.results_stream_group, *ids)
+            pipeline.execute_command('XDEL', self.config.results_stream_key, *ids)
+            pipeline.execute()
+        except Exception as ex:
+            self.log_exception(ex, self._ack_stream_entries.__name__)
+
+    def _append_results(self, contents, on_appended):
+        """
+        Appends a batch of result messages to a consolidated results shard and removes them from the queue or stream once they
+        are appended.
+
+        :param list contents: the contents of the result messages
+        :param function on_appended: called once the messages are appended
+        :return: count of results appended
+        :rtype: int
+        """
+        num_of_results = 0
+        if contents:
+            try:
+                # append the results to the next consolidated results shard
+                num_of_results = self.result_shards.append(contents)
+            except Exception as ex:
+                # the messages are consolidated again by a later run
+                self.log_exception(ex, self._append_results.__name__)
+                return 0
+
+            try:
+                self.storage_service_cache.incrby(self.config.results_consolidated_count_redis_key, num_of_results)
+            except Exception as ex:
+                self.log_exception(ex, self._append_results.__name__)
+
+        on_appended()
+        return num_of_results
 
     def get_total_jobs_consolidated_status(self):
         """
@@ -0,0 +1,351 @@
+"""
+Resultshards.py spreads the consolidated results over shard append blobs, so consolidators append in parallel instead of
+serializing on a single blob, and writes a manifest listing the shards and their result counts.
+
+Shards are named after results_consolidated_file, allresults.txt is sharded into allresults.000.txt, allresults.001.txt
+and on. Appends rotate over results_consolidated_shards shard slots. A slot moves on to a new shard blob once its blob
+holds results_consolidated_shard_max_blocks append blocks, staying under the append blob block count limit. Every
+append is a single append block of whole results, so appends from parallel consolidators never interleave a result.
+
+Result messages carry the record id of every result before its base64 ciphertext, text shards hold the base64 lines
+without the ids. With results_consolidated_format binary, shards hold the raw ciphertext of every result in
+length-prefixed frames instead of base64 lines, allresults.000.bin and on. Each shard has a sidecar index,
+allresults.000.idx, with an entry of the record id and the offset and length of the ciphertext of every frame, so a
+result is looked up by its record id in the indexes and read with a ranged GET. An index block that cannot be appended
+after its frames were appended is kept in redis and appended by a later append or by write_manifest, so the frames are
+not appended again.
+"""
+import base64
+import itertools
+import json
+import os
+import struct
+import threading
+
+# maximum size of an append block
+MAX_APPEND_BLOCK_BYTES = 4 * 1024 * 1024
+
+# length prefix of a binary frame
+FRAME_HEADER = struct.Struct('>I')
+
+# index entry of a binary frame: offset and length of the ciphertext in the shard and the length of the record id that
+# follows the entry
+INDEX_ENTRY = struct.Struct('>QIH')
+
+def split_result_line(line):
+    """
+    :param str line: a result line of a result message, the base64 ciphertext optionally preceded by the record id and
+        a space
+    :return: tuple of the record id, None when the line has none, and the base64 ciphertext
+    :rtype: tuple
+    """
+    if ' ' not in line:
+        return None, line
+    return tuple(line.split(' ', 1))
+
+def get_manifest_name(config):
+    """
+    :param Config config: the config
+    :return: name of the manifest blob, allresults.manifest.json for allresults.txt
+    :rtype: str
+    """
+    base, ext = os.path.splitext(config.results_consolidated_file)
+    return base + '.manifest.json'
+
+def read_manifest(storage_service, config):
+    """
+    Reads the shards of the consolidated results
+
+    :param BlockBlobService storage_service: the blob service of the results container
+    :param Config config: the config
+    :return: list of dictionaries with the name, count and format of every shard and the index of binary shards, None
+        when there is no manifest
+    :rtype: list
+    """
+    manifest_name = get_manifest_name(config)
+    if not storage_service.exists(config.results_container_name, blob_name=manifest_name):
+        return None
+
+    manifest = json.loads(storage_service.get_blob_to_text(config.results_container_name, manifest_name).content)
+    for shard in manifest['shards']:
+        shard.setdefault('format', manifest.get('format', 'text'))
+    return manifest['shards']
+
+def read_index(storage_service, config, shard):
+    """
+    Reads the index of a binary shard
+
+    :param BlockBlobService storage_service: the blob service of the results container
+    :param Config config: the config
+    :param dict shard: a binary shard of the manifest
+    :return: dictionary of the record id of every result with an id to the offset and length of its ciphertext
+    :rtype: dict
+    """
+    data = storage_service.get_blob_to_bytes(config.results_container_name, shard['index']).content
+    index = {}
+    position = 0
+    while position + INDEX_ENTRY.size <= len(data):
+        offset, length, id_length = INDEX_ENTRY.unpack_from(data, position)
+        position += INDEX_ENTRY.size
+        if id_length:
+            index[data[position:position + id_length]] = (offset, length)
+        position += id_length
+    return index
+
+def read_indexed_result(storage_service, config, shards, recordId):
+    """
+    Reads a single result of the binary shards, looking up its record id in the shard indexes and reading its
+    ciphertext with a ranged GET
+
+    :param BlockBlobService storage_service: the blob service of the results container
+    :param Config config: the config
+    :param list shards: the binary shards of the manifest to look the result up in
+    :param str recordId: the record id of the result, the job status id of its record
+    :return: tuple of the shard name and the ciphertext of the result, None when no shard holds the result
+    :rtype: tuple
+    """
+    for shard in shards:
+        entry = read_index(storage_service, config, shard).get(recordId)
+        if entry is None:
+            continue
+
+        offset, length = entry
+        ciphertext = storage_service.get_blob_to_bytes(config.results_container_name, shard['name'],
+            start_range=offset, end_range=offset + length - 1).content
+        return shard['name'], ciphertext
+    return None
+
+class ResultShards(object):
+    """
+    Appends consolidated results to the shard blobs and tracks the shards in redis
+    """
+    def __init__(self, logger, config, append_storage_service, storage_service, redis_conn):
+        """
+        :param logger logger: The logger instance to use for logging
+        :param Config config: the config
+        :param AppendBlobService append_storage_service: the append blob service of the results container
+        :param BlockBlobService storage_service: the blob service the manifest is written with
+        :param object redis_conn: Redis connection the shard counts are kept in
+        """
+        self.logger = logger
+        self.config = config
+        self.append_storage_service = append_storage_service
+        self.storage_service = storage_service
+        self.redis_conn = redis_conn
+        self.shards = max(1, config.results_consolidated_shards)
+        self.binary = config.results_consolidated_format == 'binary'
+        self.slots = itertools.cycle(range(self.shards))
+        self.slots_lock = threading.Lock()
+        self.created = set()
+
+    def get_shard_name(self, index):
+        """
+        :param int index: the shard index
+        :return: name of the shard blob, results_consolidated_file itself when results are not sharded
+        :rtype: str
+        """
+        if self.shards == 1 and index == 0 and not self.binary:
+            return self.config.results_consolidated_file
+
+        base, ext = os.path.splitext(self.config.results_consolidated_file)
+        return '{0}.{1:03d}{2}'.format(base, index, '.bin' if self.binary else ext)
+
+    def get_index_name(self, name):
+        """
+        :param str name: name of a binary shard
+        :return: name of the index of the shard
+        :rtype: str
+        """
+        return os.path.splitext(name)[0] + '.idx'
+
+    def _ensure_blob(self, name):
+        """
+        Creates a shard blob when it does not exist yet
+        """
+        if name in self.created:
+            return
+
+        if not self.append_storage_service.exists(self.config.results_container_name, blob_name=name):
+            self.append_storage_service.create_blob(self.config.results_container_name, name)
+        self.created.add(name)
+
+    def _next_shard(self):
+        """
+        :return: index of the shard of the next slot in the rotation
+        :rtype: int
+        """
+        with self.slots_lock:
+            slot = next(self.slots)
+
+        index = self.redis_conn.hget(self.config.results_consolidated_shards_redis_key, 'slot:{0}'.format(slot))
+        return int(index) if index is not None else slot
+
+    def append(self, contents):
+        """
+        Appends results to the next shard, in append blocks of whole results
+
+        :param list contents: the result messages, a packed message holds one result per line
+        :return: count of results appended
+        :rtype: int
+        """
+        index = self._next_shard()
+        name = self.get_shard_name(index)
+        self._ensure_blob(name)
+
+        if self.binary:
+            self._ensure_blob(self.get_index_name(name))
+            self._append_pending_index(self.get_index_name(name))
+            num_of_results, num_of_blocks = self._append_binary(name, contents)
+        else:
+            num_of_results, num_of_blocks = self._append_text(name, contents)
+
+        pipeline = self.redis_conn.pipeline()
+        pipeline.hincrby(self.config.results_consolidated_shards_redis_key, name, num_of_results)
+        pipeline.hincrby(self.config.results_consolidated_shards_redis_key, name + ':blocks', num_of_blocks)
+        total_blocks = pipeline.execute()[1]
+
+        # the appender that fills the shard moves its slot on to a new shard blob
+        max_blocks = self.config.results_consolidated_shard_max_blocks
+        if total_blocks >= max_blocks and total_blocks - num_of_blocks < max_blocks:
+            self.logger.info("Shard %s holds %d append blocks, rotating to a new shard", name, total_blocks)
+            self.redis_conn.hset(self.config.results_consolidated_shards_redis_key,
+                'slot:{0}'.format(index % self.shards), index + self.shards)
+
+        return num_of_results
+
+    def _append_text(self, name, contents):
+        """
+        Appends result messages as base64 lines
+
+        :param str name: the shard name
+        :param list contents: the result messages, a packed message holds one result per line
+        :return: tuple of the count of results and the count of append blocks appended
+        """
+        blocks = []
+        block = []
+        block_size = 0
+        num_of_results = 0
+        for content in contents:
+            # the text shards hold the base64 lines without the record ids
+            line = "\n".join(split_result_line(result)[1] for result in content.split("\n")) + "\n"
+            if block and block_size + len(line) > MAX_APPEND_BLOCK_BYTES:
+                blocks.append(''.join(block))
+                block = []
+                block_size = 0
+            block.append(line)
+            block_size += len(line)
+            num_of_results += content.count("\n") + 1
+        if block:
+            blocks.append(''.join(block))
+
+        for block in blocks:
+            self.append_storage_service.append_block(self.config.results_container_name, name, block)
+
+        return num_of_results, len(blocks)
+
+    def _append_binary(self, name, contents):
+        """
+        Appends result messages as length-prefixed frames of their ciphertext, and the index entries of the frames of
+        every append block to the shard index once the block is appended. An index block that cannot be appended is
+        kept to be appended later, so the appended frames are not appended again by a retry of the messages.
+
+        :param str name: the shard name
+        :param list contents: the result messages, a packed message holds one result per line
+        :return: tuple of the count of results and the count of append blocks appended
+        """
+        blocks = []
+        block = []
+        block_size = 0
+        entries = []
+        for content in contents:
+            for line in content.split("\n"):
+                result_id, line = split_result_line(line)
+                result_id = result_id or ''
+                ciphertext = base64.b64decode(line)
+                if block and block_size + FRAME_HEADER.size + len(ciphertext) > MAX_APPEND_BLOCK_BYTES:
+                    blocks.append((''.join(block), entries))
+                    block = []
+                    block_size = 0
+                    entries = []
+                block.append(FRAME_HEADER.pack(len(ciphertext)))
+                block.append(ciphertext)
+                # offset of the ciphertext within the block
+                entries.append((block_size + FRAME_HEADER.size, len(ciphertext), result_id))
+                block_size += FRAME_HEADER.size + len(ciphertext)
+        if block:
+            blocks.append((''.join(block), entries))
+
+        num_of_results = 0
+        for block, entries in blocks:
+            properties = self.append_storage_service.append_block(self.config.results_container_name, name, block)
+            block_offset = int(properties.append_offset)
+            index = ''.join(INDEX_ENTRY.pack(block_offset + offset, length, len(result_id)) + result_id
+                for offset, length, result_id in entries)
+            self._append_index(self.get_index_name(name), index)
+            num_of_results += len(entries)
+
+        return num_of_results, len(blocks)
+
+    def get_pending_index_key(self, index_name):
+        """
+        :param str index_name: name of a shard index
+        :return: redis list of the index blocks still to be appended to the index
+        :rtype: str
+        """
+        return self.config.results_consolidated_shards_redis_key + ':pending-index:' + index_name
+
+    def _append_index(self, index_name, index):
+        """
+        Appends an index block to a shard index, or keeps it in redis when the append fails. Raises when the block
+        can be neither appended nor kept.
+
+        :param str index_name: name of the shard index
+        :param str index: the index block
+        """
+        try:
+            self.append_storage_service.append_block(self.config.results_container_name, index_name, index)
+        except Exception as ex:
+            self.logger.warning("Appending to index %s failed, keeping the block to append later: %s", index_name, ex)
+            self.redis_conn.rpush(self.get_pending_index_key(index_name), index)
+
+    def _append_pending_index(self, index_name):
+        """
+        Appends the index blocks kept in redis to a shard index. Each block is popped before it is appended, so
+        parallel appenders do not append it twice, and pushed back when the append fails.
+
+        :param str index_name: name of the shard index
+        """
+        pending_key = self.get_pending_index_key(index_name)
+        while True:
+            index = self.redis_conn.lpop(pending_key)
+            if index is None:
+                return
+            try:
+                self.append_storage_service.append_block(self.config.results_container_name, index_name, index)
+            except Exception as ex:
+                self.logger.warning("Appending a kept block to index %s failed: %s", index_name, ex)
+                self.redis_conn.rpush(pending_key, index)
+                return
+
+    def write_manifest(self):
+        """
+        Writes the manifest listing every shard and its result count, once the index blocks kept in redis are appended
+
+        :return: the shards in the manifest
+        :rtype: list
+        """
+        counts = self.redis_conn.hgetall(self.config.results_consolidated_shards_redis_key)
+        shards = []
+        for name, count in counts.items():
+            if ':' in name:
+                continue
+            shard = {'name': name, 'count': int(count), 'format': 'binary' if name.endswith('.bin') else 'text'}
+            if shard['format'] == 'binary':
+                shard['index'] = self.get_index_name(name)
+                self._append_pending_index(shard['index'])
+            shards.append(shard)
+        shards.sort(key=lambda shard: shard['name'])
+
+        self.storage_service.create_blob_from_text(self.config.results_container_name, get_manifest_name(self.config),
+            json.dumps({'format': self.config.results_consolidated_format, 'shards': shards}))
+        return shards
@@ -0,0 +1,177 @@
+"""
+Resultsreader.py reads the consolidated results with bounded memory: shards are downloaded with parallel ranged GETs,
+split on result boundaries, and decrypted and decoded on a process pool, while the records are yielded in order.
+
+module deps:
+pip install futures
+"""
+import base64
+import collections
+import json
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from aescipher import AESCipher
+from compression import PayloadCompressor
+from resultshards import FRAME_HEADER, read_manifest
+
+# cipher and decompressor of a decode process
+_DECODER = {}
+
+def _init_decoder(key, iv_length):
+    """
+    Builds the cipher of a decode process once
+    """
+    _DECODER['cipher'] = AESCipher(key, iv_length)
+    _DECODER['compressor'] = PayloadCompressor()
+
+def _decode_results(ciphertexts, parse_json):
+    """
+    Decrypts, decompresses and optionally parses a batch of results in a decode process
+
+    :param list ciphertexts: the ciphertexts of the results
+    :param bool parse_json: parse each result as JSON
+    :return: the decoded results
+    :rtype: list
+    """
+    cipher = _DECODER['cipher']
+    compressor = _DECODER['compressor']
+    decoded = [compressor.decode(cipher.decrypt(ciphertext)) for ciphertext in ciphertexts]
+    return [json.loads(result) for result in decoded] if parse_json else decoded
+
+def split_text(data):
+    """
+    Splits base64 lines into ciphertexts
+
+    :param str data: downloaded data
+    :return: tuple of the ciphertexts of the complete lines and the incomplete rest of the data
+    """
+    end = data.rfind('\n') + 1
+    return [base64.b64decode(line) for line in data[:end].splitlines() if line], data[end:]
+
+def split_frames(data):
+    """
+    Splits length-prefixed binary frames into ciphertexts
+
+    :param str data: downloaded data
+    :return: tuple of the ciphertexts of the complete frames and the incomplete rest of the data
+    """
+    ciphertexts = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        length = FRAME_HEADER.unpack_from(data, offset)[0]
+        if offset + FRAME_HEADER.size + length > len(data):
+            break
+        offset += FRAME_HEADER.size
+        ciphertexts.append(data[offset:offset + length])
+        offset += length
+    return ciphertexts, data[offset:]
+
+class ResultsReader(object):
+    """
+    Iterates over the consolidated results
+    """
+    def __init__(self, config, storage_service, aes_cipher, processes=None, range_size_mb=4, downloads=8,
+                 batch_size=500):
+        """
+        :param Config config: the config
+        :param BlockBlobService storage_service: the blob service of the results container
+        :param AESCipher aes_cipher: the cipher the results are encrypted with
+        :param int processes: number of decode processes, None for one per cpu
+        :param int range_size_mb: size of every ranged GET in MB
+        :param int downloads: maximum number of ranged GETs in flight
+        :param int batch_size: number of results decoded per task of a decode process
+        """
+        self.config = config
+        self.storage_service = storage_service
+        self.aes_cipher = aes_cipher
+        self.processes = processes or multiprocessing.cpu_count()
+        self.range_size = range_size_mb * 1024 * 1024
+        self.downloads = downloads
+        self.batch_size = batch_size
+
+    def get_shards(self):
+        """
+        :return: the shards listed in the manifest, or the single consolidated file written before results were sharded
+        :rtype: list
+        """
+        shards = read_manifest(self.storage_service, self.config)
+        if shards is None:
+            shards = [{'name': self.config.results_consolidated_file, 'count': None, 'format': 'text'}]
+        return shards
+
+    def _download_range(self, name, start, end):
+        return self.storage_service.get_blob_to_bytes(self.config.results_container_name, name,
+            start_range=start, end_range=end, max_connections=1).content
+
+    def read_ranges(self, name):
+        """
+        Downloads a blob with parallel ranged GETs, with at most downloads ranges in memory
+
+        :param str name: the blob name
+        :return: generator of the ranges of the blob, in order
+        """
+        size = self.storage_service.get_blob_properties(self.config.results_container_name, name).properties.content_length
+
+        executor = ThreadPoolExecutor(max_workers=self.downloads)
+        try:
+            in_flight = collections.deque()
+            for start in xrange(0, size, self.range_size):
+                in_flight.append(executor.submit(self._download_range, name, start, min(start + self.range_size, size) - 1))
+                if len(in_flight) >= self.downloads:
+                    yield in_flight.popleft().result()
+
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            executor.shutdown(wait=False)
+
+    def read_ciphertexts(self, shard):
+        """
+        Reads the ciphertexts of the results of a shard
+
+        :param dict shard: a shard of the manifest
+        :return: generator of batches of up to batch_size ciphertexts
+        """
+        split = split_frames if shard['format'] == 'binary' else split_text
+
+        rest = ''
+        batch = []
+        for data in self.read_ranges(shard['name']):
+            ciphertexts, rest = split(rest + data)
+            batch.extend(ciphertexts)
+            while len(batch) >= self.batch_size:
+                yield batch[:self.batch_size]
+                batch = batch[self.batch_size:]
+
+        # a text shard may end without a newline
+        if rest.strip() and shard['format'] != 'binary':
+            batch.append(base64.b64decode(rest.strip()))
+        if batch:
+            yield batch
+
+    def read(self, parse_json=True):
+        """
+        Reads all results, decoding them on the process pool with at most two batches per process in flight
+
+        :param bool parse_json: yield every result parsed as JSON, else as the decoded string
+        :return: generator of the results, in shard order
+        """
+        pool = multiprocessing.Pool(self.processes, _init_decoder, (self.aes_cipher._key, self.aes_cipher._iv_length))
+        try:
+            in_flight = collections.deque()
+            for shard in self.get_shards():
+                for batch in self.read_ciphertexts(shard):
+                    in_flight.append(pool.apply_async(_decode_results, (batch, parse_json)))
+                    if len(in_flight) >= self.processes * 2:
+                        for result in in_flight.popleft().get():
+                            yield result
+
+            while in_flight:
+                for result in in_flight.popleft().get():
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __iter__(self):
+        return self.read()
@@ -6,24 +6,45 @@ module deps:
 pip install rq
 """
 import argparse
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
+import os
 import redis
 import time
 import sys
 import socket
 from datetime import datetime
 from config import Config
-from functions import processing_job
+from functions import processing_job, processing_job_batch
 from rq import Queue, Connection
+from rq.job import Job
 from aescipher import AESCipher
 from aeskeywrapper import AESKeyWrapper
-from jobstatus import JobStatus, JobState
+from backpressure import Backpressure
+from jobstatus import JobStatus, JobState, batch_job_status_id
 from metricslogger import MetricsLogger
 from validator import Validator
 from workloadTracker import WorkloadTracker, WorkloadEventType
 
 LOGGER = logging.getLogger(__name__)
 
+class ScheduleSummary(object):
+    """
+    Aggregate counts for a scheduler run
+    """
+    def __init__(self):
+        """
+        Initializes a new instance of the ScheduleSummary custom object.
+        """
+        self.count = 0
+        self.first_job_id = None
+        self.last_job_id = None
+        self.elapsed_sec = 0.0
+        self.records_per_sec = 0.0
+
 class Scheduler(object):
     """
     Scheduler class enqueues jobs to Redis Q
@@ -33,6 +54,7 @@ class Scheduler(object):
         :param logger logger: logger
         :param str redis_host: Redis host where the Redis Q is running
         :param int redis_port: Redis port where the Redis Q is running
+        :param WorkloadTracker workloadtracker: tracker for workload events, only needed by run
         """
         self.config = Config()
         self.logger = logger
@@ -50,14 +72,114 @@ class Scheduler(object):
         """
         return record.rstrip('\n')
 
-    def run(self, data_file_path):
+    def read_batches(self, data_file, batch_size, end=None, blob_name=None):
         """
-        Run the queueing job
+        Reads the data file from its current position and groups the formatted records into batches
+
+        :param file data_file: the opened data file
+        :param int batch_size: maximum number of records in a batch
+        :param int end: byte offset to stop reading at, reads to the end of the file when None
+        :param str blob_name: when set, the batches hold (blob name, byte offset, length) references to the
+            records instead of the formatted records
+        :return: generator of (list of records, byte offset following the last record of the batch)
+        """
+        position = data_file.tell()
+        batch = []
+        for record in data_file:
+            if end is not None and position >= end:
+                break
+
+            if blob_name is not None:
+                batch.append((blob_name, position, len(record.rstrip('\n'))))
+            else:
+                batch.append(self.format_record(record))
+            position += len(record)
+
+            if len(batch) >= batch_size:
+                yield batch, position
+                batch = []
+
+        if batch:
+            yield batch, position
 
-        :param str ata_file_path: path to the file with the data to be processed
-        :return: jobs that were queued
+    def compute_shards(self, data_file_path, shard_count):
+        """
+        Splits the data file into byte ranges that start and end on record boundaries
+
+        :param str data_file_path: path to the file with the data to be processed
+        :param int shard_count: number of shards to split the file into
+        :return: list of (start, end) byte offsets, shards without records are left out
+        """
+        size = os.path.getsize(data_file_path)
+        boundaries = [0]
+        with open(data_file_path, 'rb') as data_file:
+            for index in xrange(1, shard_count):
+                offset = max(size * index // shard_count, boundaries[-1])
+                if offset >= size:
+                    break
+
+                # move the boundary forward to the start of the next record
+                data_file.seek(max(offset - 1, 0))
+                data_file.readline()
+                boundaries.append(min(data_file.tell(), size))
+        boundaries.append(size)
+
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+    def records_per_job_from_record_size(self, data_file_path):
+        """
+        Sizes micro-batched jobs from the average size of the first records in the data file, so that the
+        payload of each job is close to scheduler_job_target_payload_kb
+
+        :param str data_file_path: path to the file with the data to be processed
+        :return: number of records to pack into each job
+        """
+        with open(data_file_path, 'r') as data_file:
+            sample = [len(record) for record in itertools.islice(data_file, 100)]
+
+        if not sample:
+            return 1
+
+        average_record_size = float(sum(sample)) / len(sample)
+        return max(1, int(self.config.scheduler_job_target_payload_kb * 1024 / average_record_size))
+
+    def enqueue_batch(self, queue, jobname, records, pipeline, records_per_job=1):
+        """
+        Builds the jobs and a job status record for each record in the batch and adds them to the redis pipeline
+
+        :param Queue queue: the Redis Q queue the jobs are enqueued to
+        :param str jobname: name of the job, stored in the job status records
+        :param list records: formatted records or record references to enqueue
+        :param Pipeline pipeline: redis pipeline the batch is written to
+        :param int records_per_job: number of consecutive records packed into a single job
+        :return: ids of the job status records added to the pipeline, one per record
+        """
+        job_status_ids = []
+        for index in xrange(0, len(records), records_per_job):
+            job_records = records[index:index + records_per_job]
+            if len(job_records) == 1:
+                job = Job.create(processing_job, args=(job_records[0], self.redis_host, self.redis_port), connection=queue.connection)
+                record_ids = [job.id]
+            else:
+                # give the job enough time to process every record in it
+                timeout = max(Queue.DEFAULT_TIMEOUT, len(job_records) * self.config.job_processing_max_time_sec)
+                job = Job.create(processing_job_batch, args=(job_records, self.redis_host, self.redis_port),
+                    connection=queue.connection, timeout=timeout)
+                record_ids = [batch_job_status_id(job.id, i) for i in xrange(len(job_records))]
+
+            queue.enqueue_job(job, pipeline=pipeline)
+            for record_id in record_ids:
+                self.jobstatus.add_job_status(jobname, record_id, JobState.queued, pipeline=pipeline)
+            job_status_ids.extend(record_ids)
+
+        return job_status_ids
+
+    def connect(self):
+        """
+        Creates a redis connection and waits until the redis server is reachable
+
+        :return: redis connection
         """
-        self.logger.info('processing data file:, %s', data_file_path)
         self.logger.info('Using redis host: %s:%s', self.redis_host, self.redis_port)
 
         # get a redis connection
@@ -74,26 +196,249 @@ class Scheduler(object):
                 self.logger.info("Redis isn't running, sleep for 5 seconds.")
                 time.sleep(5)
 
-        # read in the file and queue up jobs
-        count = 0
-        jobs = []
-        jobname = str(datetime.utcnow())
-        with open(data_file_path, 'r') as data_file:
+        return redis_conn
+
+    def enqueue_records(self, data_file_path, batch_size=None, records_per_job=None, start=0, end=None, jobname=None,
+            checkpoint_key=None, blob_name=None):
+        """
+        Reads the data file and enqueues jobs for its records. Jobs are only held in memory for the
+        batch that is being sent to redis, so memory use does not grow with the size of the data file.
+
+        Each batch is written in a single redis transaction together with the scheduled jobs count and,
+        when a checkpoint key is given, the byte offset reached, so a restarted scheduler resumes after
+        the last batch that was enqueued.
+
+        :param str data_file_path: path to the file with the data to be processed
+        :param int batch_size: number of records sent to redis in a single pipeline, defaults to the config value
+        :param int records_per_job: number of records packed into each job, 0 sizes jobs from the record size,
+            defaults to the config value
+        :param int start: byte offset of the first record to enqueue, must be the start of a record
+        :param int end: byte offset to stop enqueueing at, enqueues to the end of the file when None
+        :param str jobname: name stored in the job status records, defaults to the current time
+        :param str checkpoint_key: redis hash the progress of this byte range is checkpointed to
+        :param str blob_name: name of the data file blob, when set jobs carry a (blob name, byte offset, length)
+            reference to their records instead of the records and processors read the records from the data file
+        :return: generator of the ids of the job status records that were queued, one per record
+        """
+        if batch_size is None:
+            batch_size = self.config.scheduler_enqueue_batch_size
+        if records_per_job is None:
+            records_per_job = self.config.scheduler_records_per_job
+        if records_per_job <= 0:
+            records_per_job = self.records_per_job_from_record_size(data_file_path)
+        if jobname is None:
+            jobname = str(datetime.utcnow())
+
+        # keep every pipeline batch a whole number of jobs
+        batch_size = max(1, batch_size // records_per_job) * records_per_job
+
+        redis_conn = self.connect()
+
+        # resume from the last checkpoint of this byte range
+        offset = start
+        if checkpoint_key is not None:
+            checkpoint_offset = redis_conn.hget(checkpoint_key, str(start))
+            if checkpoint_offset is not None:
+                offset = int(checkpoint_offset)
+                self.logger.info('Resuming data file %s at offset %d, %s records were already queued',
+                    data_file_path, offset, redis_conn.hget(checkpoint_key, '{0}:count'.format(start)))
+
+        self.logger.info('processing data file:, %s [%d-%s]', data_file_path, offset, end if end is not None else 'end')
+        self.logger.info('Packing %d records per job', records_per_job)
+
+        # read in the file and queue up jobs, each batch of jobs and job status records is sent in a single transaction
+        with open(data_file_path, 'rb') as data_file:
+            data_file.seek(offset)
             with Connection(redis_conn):
                 queue = Queue()
-                for record in data_file:
-                    job = queue.enqueue(processing_job, self.format_record(record), self.redis_host, self.redis_port)
-                    self.jobstatus.add_job_status(jobname, job.id, JobState.queued)
-                    count += 1
-                    jobs.append(job)
+                backpressure = Backpressure(self.logger, redis_conn, queue)
+                for batch, position in self.read_batches(data_file, batch_size, end, blob_name):
+                    # hold the batch back while the queue is too deep or redis is using too much memory
+                    backpressure.wait()
+
+                    with redis_conn.pipeline() as pipe:
+                        job_status_ids = self.enqueue_batch(queue, jobname, batch, pipe, records_per_job)
+
+                        # update the number of jobs queued as we go, incrby is atomic so shards enqueued in parallel add up exactly
+                        pipe.incrby(self.config.scheduled_jobs_count_redis_key, len(job_status_ids))
+                        if checkpoint_key is not None:
+                            pipe.hset(checkpoint_key, str(start), position)
+                            pipe.hincrby(checkpoint_key, '{0}:count'.format(start), len(job_status_ids))
+                        pipe.execute()
+
+                    for job_status_id in job_status_ids:
+                        yield job_status_id
+
+    def get_data_file_identity(self, data_file_path):
+        """
+        Identifies the content of a data file. schedulerconfiguration.py saves the ETag of a downloaded blob next to
+        the file, which stays the same when the bootstrap downloads the same blob again. A file without a saved ETag,
+        or one changed after the ETag was saved, is identified by its size and the md5 of its content.
+
+        :param str data_file_path: path to the file with the data to be processed
+        :return: the identity of the file content
+        :rtype: str
+        """
+        size = os.path.getsize(data_file_path)
+        etag_path = data_file_path + '.etag'
+        if os.path.exists(etag_path) and os.path.getmtime(etag_path) >= os.path.getmtime(data_file_path):
+            with open(etag_path, 'rt') as etag_file:
+                return 'etag:{0}:{1}'.format(size, etag_file.read().strip())
+
+        digest = hashlib.md5()
+        with open(data_file_path, 'rb') as data_file:
+            for chunk in iter(lambda: data_file.read(1024 * 1024), ''):
+                digest.update(chunk)
+        return 'md5:{0}:{1}'.format(size, digest.hexdigest())
+
+    def get_shards(self, redis_conn, data_file_path, shard_count, restart=False):
+        """
+        Gets the shards of a data file. Shards of a file that was already partially enqueued are read from its
+        checkpoint, so the scheduler resumes with the same shards even if the shard count changed. The checkpoint
+        records the identity of the file content (see get_data_file_identity), a checkpoint of a different file at the
+        same path is discarded.
+
+        :param object redis_conn: Redis connection object
+        :param str data_file_path: path to the file with the data to be processed
+        :param int shard_count: number of shards to split a new data file into
+        :param bool restart: discard the checkpoint and enqueue the whole data file again
+        :return: tuple of the checkpoint key and the list of (start, end) byte offsets
+        """
+        checkpoint_key = self.config.scheduler_checkpoint_redis_key_prefix + data_file_path
+        identity = self.get_data_file_identity(data_file_path)
+        if restart:
+            redis_conn.delete(checkpoint_key)
+
+        layout, checkpoint_identity = redis_conn.hmget(checkpoint_key, 'shards', 'file')
+        if layout is not None and checkpoint_identity == identity:
+            self.logger.info('Found checkpoint for data file %s', data_file_path)
+            return checkpoint_key, [tuple(shard) for shard in json.loads(layout)]
+
+        if layout is not None:
+            self.logger.warning('Discarding the checkpoint of data file %s, it was written for a different file (%s, now %s)',
+                data_file_path, checkpoint_identity, identity)
+            redis_conn.delete(checkpoint_key)
+
+        shards = self.compute_shards(data_file_path, shard_count)
+        redis_conn.hmset(checkpoint_key, {'shards': json.dumps(shards), 'file': identity})
+        return checkpoint_key, shards
+
+    def summarize(self, job_status_ids):
+        """
+        Consumes the job status ids produced by enqueue_records
 
-        # Store number of jobs queued to Redis
-        redis_conn.incrby(self.config.scheduled_jobs_count_redis_key, count)
+        :param job_status_ids: generator of the ids of the job status records that were queued
+        :return: aggregate counts of the jobs that were queued
+        :rtype: ScheduleSummary
+        """
+        summary = ScheduleSummary()
+        for job_status_id in job_status_ids:
+            if summary.first_job_id is None:
+                summary.first_job_id = job_status_id
+            summary.last_job_id = job_status_id
+            summary.count += 1
+
+        return summary
+
+    def run(self, data_file_paths, batch_size=None, records_per_job=None, processes=None, restart=False, by_reference=None,
+            blob_names=None):
+        """
+        Run the queueing job. Every data file is split into shards on record boundaries and the shards are
+        enqueued in parallel worker processes.
+
+        :param data_file_paths: path or list of paths to the files with the data to be processed
+        :param int batch_size: number of records sent to redis in a single pipeline, defaults to the config value
+        :param int records_per_job: number of records packed into each job, 0 sizes jobs from the record size,
+            defaults to the config value
+        :param int processes: number of processes enqueueing shards, 0 uses one per cpu, defaults to the config value
+        :param bool restart: discard the checkpoints of the data files and enqueue them from the beginning
+        :param bool by_reference: enqueue references to the records instead of the records, defaults to the config value
+        :param list blob_names: blob names of the data files used in record references, defaults to the data file names
+        :return: aggregate counts of the jobs that were queued
+        :rtype: ScheduleSummary
+        """
+        if isinstance(data_file_paths, basestring):
+            data_file_paths = [data_file_paths]
+        if batch_size is None:
+            batch_size = self.config.scheduler_enqueue_batch_size
+        if records_per_job is None:
+            records_per_job = self.config.scheduler_records_per_job
+        if processes is None:
+            processes = self.config.scheduler_processes
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        if by_reference is None:
+            by_reference = self.config.scheduler_enqueue_by_reference
+        if not blob_names:
+            blob_names = [os.path.basename(data_file_path) for data_file_path in data_file_paths]
+
+        # build the shards for all data files, automatic job sizing is sampled once per file
+        redis_conn = self.connect()
+        jobname = str(datetime.utcnow())
+        shards = []
+        checkpoint_keys = []
+        for data_file_path, blob_name in zip(data_file_paths, blob_names):
+            file_records_per_job = records_per_job
+            if file_records_per_job <= 0:
+                file_records_per_job = self.records_per_job_from_record_size(data_file_path)
+
+            checkpoint_key, file_shards = self.get_shards(redis_conn, data_file_path, processes, restart)
+            checkpoint_keys.append(checkpoint_key)
+            for start, end in file_shards:
+                shards.append((self.redis_host, self.redis_port, dict(data_file_path=data_file_path, batch_size=batch_size,
+                    records_per_job=file_records_per_job, start=start, end=end, jobname=jobname, checkpoint_key=checkpoint_key,
+                    blob_name=blob_name if by_reference else None)))
+
+        self.logger.info('Enqueueing %d shards from %d data files with %d processes', len(shards), len(data_file_paths), processes)
 
-        self.logger.info('%d jobs queued', count)
-        self.workloadtracker.write(WorkloadEventType.JOBS_QUEUE_DONE, str(count) + ' jobs queued.')
+        summary = ScheduleSummary()
+        start_time = time.time()
+        if processes == 1:
+            shard_summaries = [_enqueue_shard(shard, self) for shard in shards]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                shard_summaries = pool.map(_enqueue_shard, shards)
+            finally:
+                pool.close()
+                pool.join()
+
+        # every shard was enqueued to its end, a later run of the same data file starts from the beginning
+        if checkpoint_keys:
+            redis_conn.delete(*checkpoint_keys)
+
+        for shard_summary in shard_summaries:
+            if summary.first_job_id is None:
+                summary.first_job_id = shard_summary.first_job_id
+            if shard_summary.last_job_id is not None:
+                summary.last_job_id = shard_summary.last_job_id
+            summary.count += shard_summary.count
+
+        summary.elapsed_sec = time.time() - start_time
+        summary.records_per_sec = summary.count / summary.elapsed_sec if summary.elapsed_sec > 0 else float(summary.count)
+
+        self.logger.info('%d jobs queued in %.2f seconds (%.2f records/sec), first job: %s, last job: %s',
+            summary.count, summary.elapsed_sec, summary.records_per_sec, summary.first_job_id, summary.last_job_id)
+        self.workloadtracker.write(WorkloadEventType.JOBS_QUEUE_DONE,
+            '{0} jobs queued. {1:.2f} records/sec'.format(summary.count, summary.records_per_sec))
+
+        return summary
+
+def _enqueue_shard(shard, scheduler=None):
+    """
+    Enqueues the records of a single shard, runs in the scheduler's worker processes
+
+    :param tuple shard: (redis host, redis port, enqueue_records keyword arguments)
+    :param Scheduler scheduler: scheduler to use, a new one is created when None
+    :return: aggregate counts of the jobs that were queued
+    :rtype: ScheduleSummary
+    """
+    redis_host, redis_port, enqueue_args = shard
+    if scheduler is None:
+        scheduler = Scheduler(LOGGER, redis_host, redis_port, None)
 
-        return jobs
+    return scheduler.summarize(
+        scheduler.enqueue_records(**enqueue_args))
 
 def init_logging():
     """
@@ -111,9 +456,20 @@ def parse_args():
     """
     config = Config()
     parser = argparse.ArgumentParser(description='Enqueue jobs to Redis Q')
-    parser.add_argument('dataFilePath', help='path to the data file.')
+    parser.add_argument('dataFilePath', nargs='+', help='path to the data file, several data files can be given.')
     parser.add_argument('--redisHost', help='Redis Q host.', default=config.redis_host)
     parser.add_argument('--redisPort', help='Redis Q port.', default=config.redis_port)
+    parser.add_argument('--batchSize', help='Number of records enqueued per redis pipeline.', type=int, default=config.scheduler_enqueue_batch_size)
+    parser.add_argument('--recordsPerJob', help='Number of records packed into each job, 0 sizes jobs from the record size.',
+        type=int, default=config.scheduler_records_per_job)
+    parser.add_argument('--processes', help='Number of processes enqueueing shards of the data files, 0 uses one per cpu.',
+        type=int, default=config.scheduler_processes)
+    parser.add_argument('--restart', help='Ignore the checkpoints of a previous run and enqueue the data files from the beginning.',
+        action='store_true')
+    parser.add_argument('--byReference', help='Enqueue references to the records, processors read the records from the data files.',
+        action='store_true', default=config.scheduler_enqueue_by_reference)
+    parser.add_argument('--blobNames', help='Comma separated blob names of the data files, used in record references.',
+        type=lambda names: names.split(','))
 
     return parser.parse_args()
 
@@ -132,7 +488,8 @@ if __name__ == "__main__":
     
     # start program
     SCHEDULER = Scheduler(LOGGER, ARGS.redisHost, ARGS.redisPort, WORKLOADTRACKER)
-    JOBS = SCHEDULER.run(ARGS.dataFilePath)
+    SUMMARY = SCHEDULER.run(ARGS.dataFilePath, ARGS.batchSize, ARGS.recordsPerJob, ARGS.processes, ARGS.restart,
+        ARGS.byReference, ARGS.blobNames)
 
     # create an instance of MetricsLogger to begin capturing VM metrics
     METRICSLOGGER = MetricsLogger(LOGGER)
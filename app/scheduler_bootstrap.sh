@@ -11,5 +11,13 @@ pip install futures
 
 tar -xzf app.tar.gz
 
+# $1 is the encrypted data blob name, or a comma separated list of blob names
+if [[ $1 == *,* ]]
+then
+    DATA_FILES=$(echo $1 | tr ',' '\n' | xargs -n1 basename | sed 's|^|data/|')
+else
+    DATA_FILES=data/data.encrypted
+fi
+
 python app/schedulerconfiguration.py $1
-python app/scheduler-unencrypted.py data/data.encrypted --redisHost $2 --redisPort 6379 2>&1 | python app/queuelogger.py
+python app/scheduler-unencrypted.py $DATA_FILES --blobNames $1 --redisHost $2 --redisPort 6379 2>&1 | python app/queuelogger.py
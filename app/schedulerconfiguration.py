@@ -48,16 +48,27 @@ blob_service.get_blob_to_path(container_name=config.storage_container_name,
 encrypted_script_filename = os.path.join(config.encrypted_files_folder, config.encrypted_scheduler_script_filename)
 decrypted_script_filename = os.path.join(config.app_code_folder, config.unencrypted_scheduler_script_filename)
 
-# Get blob encrypted data file from the cmd line arg
+# Get blob encrypted data files from the cmd line arg, several blobs can be given as a comma separated list
 if len(sys.argv) == 2:
-    blob_data_file_name = sys.argv[1]
+    blob_data_file_names = sys.argv[1].split(',')
 else:
-    blob_data_file_name = config.encrypted_data_filename
+    blob_data_file_names = [config.encrypted_data_filename]
 
-# Download encrypted data file
-blob_service.get_blob_to_path(container_name=config.storage_container_name,
-                              blob_name=blob_data_file_name,
-                              file_path=os.path.join(config.encrypted_files_folder, config.encrypted_data_filename))
+# Download encrypted data files, a single data file is saved as the configured data file name
+# and several data files are saved under their blob names. The ETag of each blob is saved next to its file, the
+# scheduler checkpoints identify the data file by it, so a checkpoint survives the download of the same blob
+for blob_data_file_name in blob_data_file_names:
+    if len(blob_data_file_names) == 1:
+        data_file_name = config.encrypted_data_filename
+    else:
+        data_file_name = os.path.basename(blob_data_file_name)
+
+    data_file_path = os.path.join(config.encrypted_files_folder, data_file_name)
+    blob = blob_service.get_blob_to_path(container_name=config.storage_container_name,
+                                         blob_name=blob_data_file_name,
+                                         file_path=data_file_path)
+    with open(data_file_path + '.etag', 'wt') as etag_file:
+        etag_file.write(blob.properties.etag)
 
 # Decode AES key
 wrapper = AESKeyWrapper(vault = config.azure_keyvault_url,
@@ -28,6 +28,9 @@ if __name__ == "__main__":
         results.write_result(str(x))
         print("Created results blob #" + str(x))
 
+    # write the results that are still buffered when results are packed
+    results.flush_results()
+
     resultsCount = results.count_consolidated_results()
 
     print("Results count: " + str(resultsCount))
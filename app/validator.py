@@ -4,10 +4,9 @@ import redis
 import time
 import socket
 import sys
-import pickle
 from datetime import datetime
 from rq import Queue, Connection, Worker, get_failed_queue
-from jobstatus import JobState
+from jobstatus import JobState, JobStatus
 from results import Results
 from config import Config
 from workloadTracker import WorkloadTracker, WorkloadEventType
@@ -33,6 +32,7 @@ class Validator(object):
         self.redis_host = redisHost
         self.redis_port = redisPort
         self.results = Results(logger, redisHost, redisPort)
+        self.jobstatus = JobStatus(logger, redisHost, redisPort)
         self.workloadTracker = WorkloadTracker(self.logger)
 
     def check_failed_queue(self, redis_conn):
@@ -55,38 +55,22 @@ class Validator(object):
         """
         # TODO: Requeue job
 
-    def validate_job_health(self, job_key, redis_conn):
+    def validate_job_health(self, jobStatus):
         """
-        Validates the health of a job based on the job state and life timespan
+        Validates the health of a job based on the job state and the time since its last transition
 
-        :param str job_key: Key to retrieve job status
-        :param object redis_conn: Redis connection object
+        :param JobStatusRecord jobStatus: The job status record of the job
         """
-        # get the job from redis
-        jobStatusSerialized = redis_conn.get(job_key)
-
-        if(jobStatusSerialized != None):
-            jobStatus = pickle.loads(jobStatusSerialized)
-            # check to see if processing started on the job,
-            # if the job is still in queued state do nothing and wait for a worker to pick it up to process
-            if(jobStatus.job_state == JobState.processing or jobStatus.job_state == JobState.processed):
-                # get the lifespan of the job
-                lifespan = datetime.utcnow() - jobStatus.created
-
-                # if the lifespan is greater than the config threshold, requeue it
-                if(lifespan.seconds > self.config.job_processing_max_time_sec):
-                    # requeue job for processing
-                    self.requeue_job(jobStatus.job_id)
-
-    def get_active_jobs(self, redis_conn):
-        """
-        Gets all active jobs from job status collection.
+        # check to see if processing started on the job,
+        # if the job is still in queued state do nothing and wait for a worker to pick it up to process
+        if(jobStatus.job_state == JobState.processing or jobStatus.job_state == JobState.processed):
+            # get the time since the last transition of the job, the time the state indexes are scored by
+            lifespan = datetime.utcnow() - (jobStatus.last_updated or jobStatus.created)
 
-        :param object redis_conn: Redis connection object
-        """
-        # get all job status keys from redis, if the key exists it is an active job
-        keys = redis_conn.keys(self.config.job_status_key_prefix + '*')
-        return keys
+            # if the lifespan is greater than the config threshold, requeue it
+            if(lifespan.total_seconds() > self.config.job_processing_max_time_sec):
+                # requeue job for processing
+                self.requeue_job(jobStatus.job_id)
 
     def run(self):
         """
@@ -112,14 +96,16 @@ class Validator(object):
                 time.sleep(5)
 
         with Connection(redis_conn):
-            activejobs = self.get_active_jobs(redis_conn)
-            for jobKey in activejobs:
+            # only the jobs that have been processing for longer than the threshold are read, using the state indexes
+            stalledjobs = self.jobstatus.get_stalled_job_statuses([JobState.processing, JobState.processed],
+                self.config.job_processing_max_time_sec)
+            for jobStatus in stalledjobs:
                 # validate job processing health using the job status collection
-                self.validate_job_health(jobKey, redis_conn)
+                self.validate_job_health(jobStatus)
             
             # record the number of processed jobs
             total_scheduled_jobs = int(redis_conn.get(self.config.scheduled_jobs_count_redis_key))
-            remaining_jobs = total_scheduled_jobs - len(activejobs)
+            remaining_jobs = total_scheduled_jobs - self.jobstatus.count_active_job_statuses()
             perc = float(remaining_jobs) / total_scheduled_jobs
             status_msg = "Jobs Successfully Proccessed (%): {0:.2f} ... {1}/{2}".format(perc, remaining_jobs, total_scheduled_jobs)
             self.workloadTracker.write(WorkloadEventType.WORKLOAD_PROCESSING_STATUS, status_msg)
@@ -165,6 +151,15 @@ if __name__ == "__main__":
     init_logging()
 
     ARGS = parse_args()
+
+    # rewrite job status records pickled by earlier versions as hashes and index the records by state, records that are
+    # not migrated here are migrated when they are read
+    try:
+        MIGRATED, INDEXED = JobStatus(LOGGER, ARGS.redisHost, ARGS.redisPort).migrate_job_statuses()
+        LOGGER.info('Migrated {0} pickled job status records, indexed {1} job status records'.format(MIGRATED, INDEXED))
+    except redis.exceptions.ConnectionError:
+        LOGGER.info('Redis is not running, pickled job status records are migrated when they are read')
+
     while True:
         LOGGER.info('Running Validator Sample')
         VALIDATOR = Validator(LOGGER, ARGS.redisHost, ARGS.redisPort)
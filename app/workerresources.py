@@ -0,0 +1,112 @@
+"""
+Workerresources.py holds the clients and the cipher used by processing jobs. They are built once per worker process and reused
+across jobs instead of being created for every job. The processor builds them before it starts working on jobs, so forked
+work horses inherit the cipher, the loaded kernel and the created containers and queues. A work horse creates its own
+storage clients, since HTTP connections can not be shared with the parent process. Redis clients reconnect after a fork
+by themselves.
+"""
+import os
+import nativekernel
+import workloadprofiles
+from aescipher import AESCipher
+from compression import PayloadCompressor
+from config import Config
+from datafilecache import DataFileCache
+from jobstatus import JobStatus
+from resultpipeline import ResultCompletion
+from results import Results
+
+# worker resources for each redis host and port used in this process
+_WORKER_RESOURCES = {}
+
+class WorkerResources(object):
+    """
+    Clients and cipher shared by all jobs executed in a worker process
+    """
+    def __init__(self, logger, redisHost, redisPort):
+        """
+        Builds the resources. Creating Results and JobStatus makes sure the storage containers and queues exist and
+        unwraps the results AES key, so this only happens once per worker process.
+
+        :param logger logger: The logger instance to use for logging
+        :param str redisHost: Redis host where the Redis Q is running
+        :param int redisPort: Redis port where the Redis Q is running
+        """
+        self.pid = os.getpid()
+        self.aes_cipher = self._create_aes_cipher()
+        self.payload_compressor = PayloadCompressor()
+        self.results = Results(logger, redisHost, redisPort)
+        self.jobstatus = JobStatus(logger, redisHost, redisPort)
+        self.data_file_cache = DataFileCache(logger)
+
+        # load the compute kernel before the work horses are forked
+        nativekernel.load_library()
+        config = Config()
+        self.processing_duration_sec = config.processing_kernel_duration_sec
+
+        # synthetic workload profiles, built on first use
+        self.workload_profile_name = config.workload_profile
+        self.workload_profiles = {}
+
+        # completes records whose results are written when a packed results message is sent
+        self.result_completion = ResultCompletion(logger, self.jobstatus)
+
+        # set by workers that write results on background threads
+        self.result_pipeline = None
+
+        # set by workers that run many jobs in this process, packed results are then only flushed when the worker stops
+        # and not at the end of every job
+        self.persistent = False
+
+    def after_fork(self):
+        """
+        Creates the storage clients of a forked process, the keep-alive connections of the clients inherited from the
+        parent process are shared with it and with every other forked process
+        """
+        self.pid = os.getpid()
+        self.results.create_storage_clients()
+        self.jobstatus.create_storage_clients()
+        self.data_file_cache.create_storage_clients()
+
+    def get_workload_profile(self, name):
+        """
+        Gets a synthetic workload profile, the profile keeps its random number generator across jobs
+
+        :param str name: the profile name
+        :return: the profile
+        :rtype: WorkloadProfile
+        """
+        profile = self.workload_profiles.get(name)
+        if profile is None:
+            profile = workloadprofiles.get_profile(name)
+            self.workload_profiles[name] = profile
+
+        return profile
+
+    def _create_aes_cipher(self):
+        """
+        Get the environment variables set for the AES Key from the job processor
+        and construct the AESCipher
+        :return: an AESCipher created from the AES key and IV set by the parent process
+        """
+        return AESCipher(os.environ['AES_SECRET'], int(os.environ['AES_IV_LENGTH']))
+
+def get_worker_resources(logger, redisHost, redisPort):
+    """
+    Gets the worker resources of this process, building them on first use.
+
+    :param logger logger: The logger instance to use for logging
+    :param str redisHost: Redis host where the Redis Q is running
+    :param int redisPort: Redis port where the Redis Q is running
+    :return: the worker resources
+    :rtype: WorkerResources
+    """
+    key = (str(redisHost), str(redisPort))
+    resources = _WORKER_RESOURCES.get(key)
+    if resources is None:
+        resources = WorkerResources(logger, redisHost, redisPort)
+        _WORKER_RESOURCES[key] = resources
+    elif resources.pid != os.getpid():
+        resources.after_fork()
+
+    return resources
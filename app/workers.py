@@ -0,0 +1,325 @@
+"""
+Redis Q worker classes used by processor.py
+
+module deps:
+pip install rq
+"""
+import collections
+import errno
+import os
+import resource
+import socket
+import time
+from rq import SimpleWorker, Worker
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.utils import utcnow, utcparse
+from rq.worker import WorkerStatus
+
+def get_rss_mb():
+    """
+    Gets the resident memory of the current process
+
+    :return: resident memory in MB
+    :rtype: float
+    """
+    try:
+        with open('/proc/self/statm', 'rt') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return float(resident_pages * os.sysconf('SC_PAGE_SIZE')) / (1024 * 1024)
+    except (IOError, OSError, ValueError):
+        # peak resident memory in KB on Linux, used where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class JobTimingMixin(object):
+    """
+    Adds the wall time and cpu time of every job to job_times, a multiprocessing.Array('d', 3) of
+    [number of jobs, wall seconds, cpu seconds] shared with the processor supervisor.
+    """
+    def __init__(self, queues, **kwargs):
+        """
+        :param array queues: the queues the worker will listen on
+        :param Array job_times: shared array the job times are added to, job times are not recorded when None
+        """
+        self.job_times = kwargs.pop('job_times', None)
+        super(JobTimingMixin, self).__init__(queues, **kwargs)
+
+    def execute_job(self, job, queue):
+        """
+        Executes the job and records its wall and cpu time. The cpu time includes reaped child processes,
+        so it covers jobs executed in a forked work horse.
+        """
+        start_wall = time.time()
+        start_cpu = sum(os.times()[:4])
+        result = super(JobTimingMixin, self).execute_job(job, queue)
+
+        if self.job_times is not None:
+            with self.job_times.get_lock():
+                self.job_times[0] += 1
+                self.job_times[1] += time.time() - start_wall
+                self.job_times[2] += sum(os.times()[:4]) - start_cpu
+
+        return result
+
+# Moves up to ARGV[1] job ids from the queues in KEYS[1..n-1], in queue priority order, to the worker prefetch list
+# KEYS[n] and returns the queue key, job id and job hash of every claimed job
+CLAIM_JOBS_SCRIPT = """
+local prefetch_key = KEYS[#KEYS]
+local count = tonumber(ARGV[1])
+local claimed = {}
+for i = 1, #KEYS - 1 do
+    while #claimed < count * 3 do
+        local job_id = redis.call('LPOP', KEYS[i])
+        if not job_id then
+            break
+        end
+        redis.call('RPUSH', prefetch_key, job_id)
+        table.insert(claimed, KEYS[i])
+        table.insert(claimed, job_id)
+        table.insert(claimed, redis.call('HGETALL', ARGV[2] .. job_id))
+    end
+end
+return claimed
+"""
+
+# Pushes the job ids of the prefetch list KEYS[1] back to the front of their queues, keeping their order, and deletes
+# the list. ARGV[1] is the job key prefix and ARGV[2] the queue key prefix.
+RETURN_JOBS_SCRIPT = """
+local job_ids = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = #job_ids, 1, -1 do
+    local origin = redis.call('HGET', ARGV[1] .. job_ids[i], 'origin')
+    if origin then
+        redis.call('LPUSH', ARGV[2] .. origin, job_ids[i])
+    end
+end
+redis.call('DEL', KEYS[1])
+return #job_ids
+"""
+
+class _JobHash(object):
+    """
+    Stands in for the redis connection while a job is loaded from a job hash that was already fetched
+    """
+    def __init__(self, job_hash):
+        self.job_hash = job_hash
+
+    def hgetall(self, key):
+        return self.job_hash
+
+def is_local_process_gone(worker_name):
+    """
+    Checks whether a worker named after the host and pid of its process, like the Redis Q default worker names, ran on
+    this host and its process no longer exists
+
+    :param str worker_name: the worker name
+    :return: True when the worker ran on this host and its process is gone
+    :rtype: boolean
+    """
+    host, _, pid = worker_name.rpartition('.')
+    if host != socket.gethostname().partition('.')[0] or not pid.isdigit():
+        return False
+
+    try:
+        os.kill(int(pid), 0)
+    except OSError as ex:
+        return ex.errno == errno.ESRCH
+    return False
+
+class PrefetchMixin(object):
+    """
+    Claims up to prefetch_count jobs in a single Redis round trip and executes them from a local buffer. Claimed jobs
+    are kept in a per-worker prefetch list in redis until they start, so the jobs still buffered when the worker stops
+    are pushed back to the front of their queues, and the lists of workers that died are returned by the sweep every
+    worker runs at start and every prefetch_sweep_interval_sec seconds.
+    """
+    redis_prefetch_namespace_prefix = 'rq:prefetch:'
+
+    def __init__(self, queues, **kwargs):
+        """
+        :param array queues: the queues the worker will listen on
+        :param int prefetch_count: number of jobs claimed per round trip, 1 or less dequeues one job at a time
+        :param int prefetch_sweep_interval_sec: seconds between sweeps for the prefetch lists of dead workers, an idle
+            worker also sends a heartbeat at this interval
+        """
+        self.prefetch_count = kwargs.pop('prefetch_count', 1)
+        self.prefetch_sweep_interval_sec = kwargs.pop('prefetch_sweep_interval_sec', 30)
+        super(PrefetchMixin, self).__init__(queues, **kwargs)
+        self.prefetched = collections.deque()
+        self.prefetch_key = self.redis_prefetch_namespace_prefix + self.name
+        self.last_sweep = 0
+        self.claim_jobs_script = self.connection.register_script(CLAIM_JOBS_SCRIPT)
+        self.return_jobs_script = self.connection.register_script(RETURN_JOBS_SCRIPT)
+
+    def work(self, *args, **kwargs):
+        """
+        Works on jobs and returns the jobs that are still buffered to their queues when the worker stops
+        """
+        if self.prefetch_count <= 1:
+            return super(PrefetchMixin, self).work(*args, **kwargs)
+
+        self.recover_prefetched()
+        try:
+            return super(PrefetchMixin, self).work(*args, **kwargs)
+        finally:
+            self.return_prefetched()
+
+    def is_worker_dead(self, worker_name):
+        """
+        Checks whether the worker that owns a prefetch list died. A worker is dead when its registration expired, when
+        it ran on this host and its process is gone, or when it is idle and missed its heartbeats, since an idle
+        prefetching worker sends a heartbeat every prefetch_sweep_interval_sec seconds. The registration of a crashed
+        worker outlives it by the worker ttl, so the last two catch a worker that is restarted by its supervisor
+        right away.
+
+        :param str worker_name: the worker name
+        :rtype: boolean
+        """
+        state, last_heartbeat = self.connection.hmget(self.redis_worker_namespace_prefix + worker_name,
+            'state', 'last_heartbeat')
+        if state is None and last_heartbeat is None:
+            return True
+
+        if is_local_process_gone(worker_name):
+            return True
+
+        # busy workers do not send heartbeats while they run a job, their registration is extended to the job timeout
+        if state == WorkerStatus.IDLE and last_heartbeat is not None:
+            silent_sec = (utcnow() - utcparse(last_heartbeat)).total_seconds()
+            return silent_sec > 3 * self.prefetch_sweep_interval_sec
+
+        return False
+
+    def recover_prefetched(self):
+        """
+        Returns the jobs in the prefetch lists of dead workers to their queues
+        """
+        self.last_sweep = time.time()
+        for prefetch_key in self.connection.scan_iter(self.redis_prefetch_namespace_prefix + '*'):
+            worker_name = prefetch_key[len(self.redis_prefetch_namespace_prefix):]
+            if worker_name == self.name or not self.is_worker_dead(worker_name):
+                continue
+
+            count = self.return_jobs_script(keys=[prefetch_key],
+                args=[self.job_class.redis_job_namespace_prefix, self.queue_class.redis_queue_namespace_prefix])
+            if count:
+                self.log.warning('Returned %d jobs prefetched by dead worker %s to their queues', count, worker_name)
+
+    def sweep_prefetched(self):
+        """
+        Returns the prefetch lists of dead workers when the sweep interval has passed
+        """
+        if self.prefetch_sweep_interval_sec > 0 and time.time() - self.last_sweep >= self.prefetch_sweep_interval_sec:
+            self.recover_prefetched()
+
+    def return_prefetched(self):
+        """
+        Returns the jobs this worker prefetched but did not start to the front of their queues
+        """
+        count = self.return_jobs_script(keys=[self.prefetch_key],
+            args=[self.job_class.redis_job_namespace_prefix, self.queue_class.redis_queue_namespace_prefix])
+        self.prefetched.clear()
+        if count:
+            self.log.info('Returned %d prefetched jobs to their queues', count)
+
+    def claim_jobs(self):
+        """
+        Claims up to prefetch_count jobs from the queues into the local buffer
+        """
+        claimed = self.claim_jobs_script(keys=[queue.key for queue in self.queues] + [self.prefetch_key],
+            args=[self.prefetch_count, self.job_class.redis_job_namespace_prefix])
+
+        for i in xrange(0, len(claimed), 3):
+            queue_key, job_id, job_hash = claimed[i], claimed[i + 1], claimed[i + 2]
+            job = self.job_class(job_id, connection=_JobHash(dict(zip(job_hash[::2], job_hash[1::2]))))
+            try:
+                job.refresh()
+            except NoSuchJobError:
+                # skip jobs that were deleted while they were queued, like dequeue_any does
+                self.connection.lrem(self.prefetch_key, 1, job_id)
+                continue
+            job.connection = self.connection
+
+            queue = self.queue_class.from_queue_key(queue_key, connection=self.connection, job_class=self.job_class)
+            self.prefetched.append((job, queue))
+
+    def dequeue_job_and_maintain_ttl(self, timeout):
+        """
+        Hands out the next buffered job, claims new jobs when the buffer is empty and blocks on the queues like the
+        stock worker when there are no jobs to claim. While blocked, the worker wakes up every
+        prefetch_sweep_interval_sec seconds to send a heartbeat and sweep the prefetch lists of dead workers.
+        """
+        if self.prefetch_count <= 1:
+            return super(PrefetchMixin, self).dequeue_job_and_maintain_ttl(timeout)
+
+        self.set_state(WorkerStatus.IDLE)
+        self.procline('Listening on ' + ','.join(self.queue_names()))
+        while True:
+            self.heartbeat()
+            self.sweep_prefetched()
+
+            if not self.prefetched:
+                self.claim_jobs()
+
+            while self.prefetched:
+                job, queue = self.prefetched.popleft()
+                # the job is tracked by the started job registry from here on, like a job popped by the stock worker.
+                # a job that is no longer in the prefetch list was returned to its queue by a sweep, while this worker
+                # looked dead, and is left to the worker that dequeues it.
+                if self.connection.lrem(self.prefetch_key, 1, job.id):
+                    self.heartbeat()
+                    self.log.info('%s: %s (%s)', queue.name, job.description, job.id)
+                    return job, queue
+
+            wait = timeout
+            if timeout is not None and self.prefetch_sweep_interval_sec > 0:
+                wait = max(1, min(timeout, self.prefetch_sweep_interval_sec))
+            try:
+                result = self.queue_class.dequeue_any(self.queues, wait, connection=self.connection,
+                    job_class=self.job_class)
+            except DequeueTimeout:
+                continue
+
+            if result is not None:
+                job, queue = result
+                self.log.info('%s: %s (%s)', queue.name, job.description, job.id)
+            self.heartbeat()
+            return result
+
+class TimedWorker(PrefetchMixin, JobTimingMixin, Worker):
+    """
+    Stock Redis Q worker that forks a work horse per job, records job times and can prefetch jobs
+    """
+
+class RecyclingWorker(PrefetchMixin, JobTimingMixin, SimpleWorker):
+    """
+    Executes jobs in the worker process without forking a work horse per job, so connections, ciphers and imported
+    modules stay warm between jobs. The worker stops after max_jobs jobs or once its resident memory reaches max_rss_mb,
+    so a supervising process can replace it with a fresh one.
+    """
+    def __init__(self, queues, max_jobs=0, max_rss_mb=0, **kwargs):
+        """
+        :param array queues: the queues the worker will listen on
+        :param int max_jobs: number of jobs after which the worker stops, 0 for no limit
+        :param int max_rss_mb: resident memory in MB after which the worker stops, 0 for no limit
+        """
+        super(RecyclingWorker, self).__init__(queues, **kwargs)
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.executed_jobs = 0
+
+    def execute_job(self, job, queue):
+        """
+        Executes the job in this process and requests a stop once the worker reached its recycle limits
+        """
+        result = super(RecyclingWorker, self).execute_job(job, queue)
+        self.executed_jobs += 1
+
+        if self.max_jobs > 0 and self.executed_jobs >= self.max_jobs:
+            self.log.info('Recycling worker after %d jobs', self.executed_jobs)
+            self._stop_requested = True
+        elif self.max_rss_mb > 0:
+            rss_mb = get_rss_mb()
+            if rss_mb >= self.max_rss_mb:
+                self.log.info('Recycling worker after %d jobs, resident memory is %.1f MB', self.executed_jobs, rss_mb)
+                self._stop_requested = True
+
+        return result
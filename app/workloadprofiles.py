@@ -0,0 +1,174 @@
+"""
+Synthetic workload profiles used to benchmark the processors.
+
+A profile describes what processing a record costs: cpu_ms of CPU work on the compute kernel, memory_mb of memory
+copied, io_ms of waiting on I/O, and record_size_kb, the size of the records the data generator creates for it.
+Each value is a distribution, sampled again for every record:
+
+    {"type": "constant", "value": 10}
+    {"type": "uniform", "min": 5, "max": 50}
+    {"type": "exponential", "mean": 20}
+    {"type": "lognormal", "mu": 3, "sigma": 0.5}
+    {"type": "choice", "values": [1, 16, 256], "weights": [80, 15, 5]}
+
+A plain number is a constant. Profiles from the workload_profiles config value are added to, or replace, the
+built-in PROFILES. Record sizes are capped at MAX_RECORD_SIZE_KB, since the result of a record is written as a single
+results queue message.
+"""
+import json
+import random
+import time
+import nativekernel
+from config import Config
+
+# largest record whose result still fits a 64 KB queue message once it is encrypted and base64 encoded
+MAX_RECORD_SIZE_KB = 44
+
+PROFILES = {
+    'cpu': {
+        'cpu_ms': {'type': 'constant', 'value': 100},
+        'record_size_kb': 1
+    },
+    'memory': {
+        'memory_mb': {'type': 'constant', 'value': 64},
+        'record_size_kb': 1
+    },
+    'io': {
+        'io_ms': {'type': 'lognormal', 'mu': 3, 'sigma': 0.75},
+        'record_size_kb': 1
+    },
+    'mixed': {
+        'cpu_ms': {'type': 'exponential', 'mean': 50},
+        'memory_mb': {'type': 'choice', 'values': [0, 16], 'weights': [90, 10]},
+        'io_ms': {'type': 'lognormal', 'mu': 2, 'sigma': 1},
+        'record_size_kb': {'type': 'choice', 'values': [1, 16, 44], 'weights': [80, 15, 5]}
+    }
+}
+
+def sample(distribution, rng=random):
+    """
+    Draws a value from a distribution
+
+    :param object distribution: a distribution dictionary, a number or None
+    :param Random rng: the random number generator to use
+    :return: the value, never negative, 0 for None
+    :rtype: float
+    """
+    if distribution is None:
+        return 0
+    if isinstance(distribution, (int, long, float)):
+        return max(0, distribution)
+
+    kind = distribution.get('type', 'constant')
+    if kind == 'constant':
+        value = distribution['value']
+    elif kind == 'uniform':
+        value = rng.uniform(distribution['min'], distribution['max'])
+    elif kind == 'exponential':
+        value = rng.expovariate(1.0 / distribution['mean']) if distribution['mean'] > 0 else 0
+    elif kind == 'lognormal':
+        value = rng.lognormvariate(distribution['mu'], distribution['sigma'])
+    elif kind == 'choice':
+        values = distribution['values']
+        weights = distribution.get('weights') or [1] * len(values)
+        point = rng.uniform(0, sum(weights))
+        value = values[-1]
+        for candidate, weight in zip(values, weights):
+            point -= weight
+            if point <= 0:
+                value = candidate
+                break
+    else:
+        raise Exception("Unknown distribution type '{0}'".format(kind))
+
+    return max(0, value)
+
+class WorkloadProfile(object):
+    """
+    Synthetic workload of a single profile
+    """
+    def __init__(self, name, cpu_ms=None, memory_mb=None, io_ms=None, record_size_kb=None, seed=None):
+        """
+        :param str name: the profile name
+        :param object cpu_ms: distribution of the CPU time per record in milliseconds
+        :param object memory_mb: distribution of the memory copied per record in MB
+        :param object io_ms: distribution of the I/O wait per record in milliseconds
+        :param object record_size_kb: distribution of the record size in KB
+        :param int seed: seed of the random number generator, None for a random seed
+        """
+        self.name = name
+        self.cpu_ms = cpu_ms
+        self.memory_mb = memory_mb
+        self.io_ms = io_ms
+        self.record_size_kb = record_size_kb
+        self.rng = random.Random(seed)
+
+    def record_size(self):
+        """
+        :return: the size of the next record in bytes, at least one byte and at most MAX_RECORD_SIZE_KB
+        :rtype: int
+        """
+        return max(1, int(min(sample(self.record_size_kb, self.rng), MAX_RECORD_SIZE_KB) * 1024))
+
+    def run(self, record):
+        """
+        Performs the work of processing a single record
+
+        :param str record: the record
+        :return: dictionary of the sampled cpu_ms, memory_mb and io_ms
+        :rtype: dict
+        """
+        cpu_ms = sample(self.cpu_ms, self.rng)
+        memory_mb = sample(self.memory_mb, self.rng)
+        io_ms = sample(self.io_ms, self.rng)
+
+        if cpu_ms > 0:
+            nativekernel.process_record(record, cpu_ms / 1000.0)
+
+        if memory_mb > 0:
+            # allocate and copy the memory, so the work is bound by memory bandwidth and not by the cpu
+            memory = bytearray(int(memory_mb * 1024 * 1024))
+            copy = bytearray(memory)
+            del memory, copy
+
+        if io_ms > 0:
+            time.sleep(io_ms / 1000.0)
+
+        return {'cpu_ms': cpu_ms, 'memory_mb': memory_mb, 'io_ms': io_ms}
+
+def get_profile(name, config=None, seed=None):
+    """
+    Gets a workload profile by name
+
+    :param str name: the profile name
+    :param Config config: the config holding workload_profiles, read from the config file when None
+    :param int seed: seed of the random number generator, None for a random seed
+    :return: the profile
+    :rtype: WorkloadProfile
+    """
+    config = config or Config()
+    profiles = dict(PROFILES)
+    profiles.update(getattr(config, 'workload_profiles', None) or {})
+
+    if name not in profiles:
+        raise Exception("Unknown workload profile '{0}', known profiles: {1}".format(name, ', '.join(sorted(profiles))))
+
+    return WorkloadProfile(name, seed=seed, **profiles[name])
+
+def get_record_profile_name(record):
+    """
+    Gets the profile a record was generated for
+
+    :param str record: the decrypted record
+    :return: the profile name, None when the record does not name one
+    """
+    # skip parsing records that can not name a profile
+    if '"profile"' not in record:
+        return None
+
+    try:
+        parsed = json.loads(record)
+    except ValueError:
+        return None
+
+    return parsed.get('profile') if isinstance(parsed, dict) else None
@@ -0,0 +1,70 @@
+# cd <root>
+# set PYTHONPATH=.
+# python samples/benchmarkCompression.py
+
+"""
+Compares the payload compression codecs on generated records: the bytes moved per record once the record is
+compressed, encrypted and base64 encoded, and the CPU time it takes to encode and to decode a record.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import time
+from app.aescipher import AESCipher
+from app.compression import PayloadCompressor, get_available_codecs
+
+def generate_records(kind, size_kb, count):
+    """
+    :param str kind: 'repetitive' for records like the data generator's, 'json' for records of varied JSON values
+    :return: list of JSON records
+    """
+    rng = random.Random(0)
+    records = []
+    for record_id in xrange(count):
+        if kind == 'repetitive':
+            data = "A" * size_kb * 1024
+        else:
+            values = []
+            while len(json.dumps(values)) < size_kb * 1024:
+                values.append({'name': 'item' + str(rng.randint(0, 10000)), 'value': rng.random(),
+                    'tags': rng.sample(['red', 'green', 'blue', 'small', 'large'], 2)})
+            data = values
+        records.append(json.dumps({'id': record_id, 'data': data}))
+    return records
+
+def benchmark(compressor, cipher, records):
+    """
+    :return: tuple of the average encoded bytes per record and the encode and decode milliseconds per record
+    """
+    start = time.clock()
+    encoded = [base64.b64encode(cipher.encrypt(compressor.encode(record))) for record in records]
+    encode_ms = (time.clock() - start) * 1000 / len(records)
+
+    start = time.clock()
+    for line in encoded:
+        compressor.decode(cipher.decrypt(base64.b64decode(line)))
+    decode_ms = (time.clock() - start) * 1000 / len(records)
+
+    return float(sum(len(line) for line in encoded)) / len(records), encode_ms, decode_ms
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the payload compression codecs')
+    parser.add_argument('--recordSize', help='record size in KB', type=int, default=1)
+    parser.add_argument('--records', help='number of records', type=int, default=1000)
+    args = parser.parse_args()
+
+    cipher = AESCipher(os.urandom(32), 16)
+    codecs = ['none'] + get_available_codecs()
+
+    for kind in ['repetitive', 'json']:
+        records = generate_records(kind, args.recordSize, args.records)
+        raw_bytes = float(sum(len(record) for record in records)) / len(records)
+        print '{0} records, {1:.0f} bytes of JSON each'.format(kind, raw_bytes)
+        print 'Codec    Bytes/record   Ratio   Encode (ms)   Decode (ms)'
+        for codec in codecs:
+            size, encode_ms, decode_ms = benchmark(PayloadCompressor(codec), cipher, records)
+            print '{0:<8} {1:>12.0f}   {2:>5.2f}   {3:>11.3f}   {4:>11.3f}'.format(codec, size, size / raw_bytes,
+                encode_ms, decode_ms)
+        print
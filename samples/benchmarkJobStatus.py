@@ -0,0 +1,92 @@
+# cd <root>
+# set PYTHONPATH=.
+# python samples/benchmarkJobStatus.py
+
+"""
+Compares the job status record formats: the protocol 0 pickle of the record with a __dict__ that earlier versions
+wrote to Redis and to the job status queue, the fields of the job status hash, and the binary record layout queued
+base64 encoded. Reports the bytes per record, the encode and decode microseconds per record and the memory of a record
+object.
+"""
+import argparse
+import base64
+import pickle
+import sys
+import time
+from datetime import datetime, timedelta
+from app.jobstatus import JobState, JobStatusRecord, decode_job_status_message
+
+class DictJobStatusRecord(object):
+    """
+    The job status record as it was before it had slots
+    """
+    def __init__(self):
+        self.job_name = ""
+        self.job_id = ""
+        self.job_state = JobState.none
+        self.created = None
+        self.last_updated = None
+        self.last_error = None
+
+def build_records(record_class, count, error):
+    records = []
+    created = datetime.utcnow()
+    for index in xrange(count):
+        record = record_class()
+        record.job_name = 'process_record'
+        record.job_id = '2b8e1f0c-6a4d-4f7e-9a53-0d6c1e8f{0:04d}.{1}'.format(index % 10000, index % 100)
+        record.job_state = int(JobState.failed if error else JobState.done)
+        record.created = created + timedelta(milliseconds=index)
+        record.last_updated = record.created + timedelta(seconds=2)
+        record.last_error = 'Traceback (most recent call last):\n  ValueError: bad record' if error else None
+        records.append(record)
+    return records
+
+def hash_size(fields):
+    return sum(len(str(name)) + len(str(value)) for name, value in fields.items())
+
+def benchmark(encode, decode, size, records):
+    """
+    :return: tuple of the average bytes per record and the encode and decode microseconds per record
+    """
+    start = time.clock()
+    encoded = [encode(record) for record in records]
+    encode_us = (time.clock() - start) * 1000000 / len(records)
+
+    start = time.clock()
+    for data in encoded:
+        decode(data)
+    decode_us = (time.clock() - start) * 1000000 / len(records)
+
+    return float(sum(size(data) for data in encoded)) / len(records), encode_us, decode_us
+
+def record_memory(record):
+    size = sys.getsizeof(record)
+    if hasattr(record, '__dict__'):
+        size += sys.getsizeof(record.__dict__)
+    return size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the job status record formats')
+    parser.add_argument('--records', help='number of records', type=int, default=100000)
+    args = parser.parse_args()
+
+    for error in [False, True]:
+        dict_records = build_records(DictJobStatusRecord, args.records, error)
+        records = build_records(JobStatusRecord, args.records, error)
+
+        print '{0} records, {1}'.format(args.records, 'failed with an error' if error else 'done')
+        print 'Format          Bytes/record   Encode (us)   Decode (us)'
+        formats = [
+            ('pickle', dict_records, pickle.dumps, pickle.loads, len),
+            ('hash', records, JobStatusRecord.to_hash, JobStatusRecord.from_hash, hash_size),
+            ('binary', records, JobStatusRecord.encode, JobStatusRecord.decode, len),
+            ('binary queue', records, lambda record: base64.b64encode(record.encode()), decode_job_status_message, len)
+        ]
+        for name, format_records, encode, decode, size in formats:
+            size, encode_us, decode_us = benchmark(encode, decode, size, format_records)
+            print '{0:<14} {1:>13.0f}   {2:>11.2f}   {3:>11.2f}'.format(name, size, encode_us, decode_us)
+        print
+
+    print 'Record object memory: {0} bytes with a __dict__, {1} bytes with slots'.format(
+        record_memory(dict_records[0]), record_memory(records[0]))
@@ -0,0 +1,75 @@
+# cd <root>
+# make -C app/cpp
+# set PYTHONPATH=.
+# python samples/benchmarkKernel.py
+
+"""
+Compares the ways a record can be processed: the Python loop, the program.cpp binary started as a subprocess per
+record, and the native kernel called in-process. Each kernel runs on a number of threads at the same time, the
+in-process native kernel releases the GIL so its threads run in parallel while the Python loop threads do not.
+"""
+import argparse
+import os
+import subprocess
+import threading
+import time
+from app import nativekernel
+
+PROGRAM_PATH = os.path.join('app', 'cpp', 'program')
+
+def run_python(record, duration_sec):
+    nativekernel.process_record_python(record, duration_sec)
+
+def run_subprocess(record, duration_sec):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([PROGRAM_PATH, 'benchmark', str(int(duration_sec))], stdout=devnull)
+
+def run_native(record, duration_sec):
+    nativekernel.process_record(record, duration_sec)
+
+def benchmark(kernel, record, duration_sec, records, threads):
+    """
+    Processes records on each of the threads with the kernel
+
+    :return: tuple of the wall seconds it took to process all records and the cpu seconds used, including
+        child processes
+    """
+    def work():
+        for i in xrange(records):
+            kernel(record, duration_sec)
+
+    workers = [threading.Thread(target=work) for i in xrange(threads)]
+    start = time.time()
+    start_cpu = sum(os.times()[:4])
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start, sum(os.times()[:4]) - start_cpu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the record processing kernels')
+    parser.add_argument('--duration', help='seconds each record is processed for, whole seconds for the subprocess',
+        type=int, default=1)
+    parser.add_argument('--records', help='records processed by each thread', type=int, default=3)
+    parser.add_argument('--threads', help='threads processing records at the same time', type=int, default=4)
+    parser.add_argument('--recordSize', help='record size in bytes', type=int, default=1024)
+    args = parser.parse_args()
+
+    record = 'x' * args.recordSize
+    kernels = [('python loop', run_python)]
+    if os.path.exists(PROGRAM_PATH):
+        kernels.append(('subprocess', run_subprocess))
+    else:
+        print '{0} not found, skipping the subprocess kernel'.format(PROGRAM_PATH)
+    if nativekernel.is_native():
+        kernels.append(('in-process native', run_native))
+    else:
+        print '{0} not loaded, skipping the in-process native kernel'.format(nativekernel.get_library_path())
+
+    ideal_sec = args.duration * args.records
+    print 'Kernel               Wall (s)    CPU (s)   Overhead per record (ms)'
+    for name, kernel in kernels:
+        elapsed, cpu = benchmark(kernel, record, args.duration, args.records, args.threads)
+        overhead_ms = (elapsed - ideal_sec) * 1000 / args.records
+        print '{0:<20} {1:>8.2f}   {2:>8.2f}   {3:>10.1f}'.format(name, elapsed, cpu, overhead_ms)
@@ -25,7 +25,8 @@ def tar_exclusion(file):
         # Step into all directories
         return False
 
-    return (file in files_to_encrypt) or (not file.endswith('py'))
+    # keep the python files and the native kernel sources
+    return (file in files_to_encrypt) or (not file.endswith(('py', '.cpp', 'makefile')))
 
 # Zip up all python files under the app folder
 with tarfile.open("app.tar.gz", "w:gz") as tar:
@@ -1,10 +1,13 @@
+import argparse
 import base64
 import json
 import os
 from app.config import Config
+from app.workloadprofiles import get_profile
 from app.aescipher import AESCipher
 from app.aeskeywrapper import AESKeyWrapper
 from app.aeshelper import AESHelper
+from app.compression import PayloadCompressor
 
 class Record(object):
     id = -1
@@ -21,24 +24,42 @@ class DataGenerator(object):
     def __init__(self, config):
         self.config = config
         self.aes_cipher = AESHelper(config).create_aescipher_from_config()
+        self.payload_compressor = PayloadCompressor(config.payload_compression, config.payload_compression_level)
 
-    def generate_data(self, size_of_record_kb, number_of_records, out_file_path):
+    def generate_data(self, size_of_record_kb, number_of_records, out_file_path, profile_name=None, seed=None):
+        """
+        Writes encrypted records to a data file
 
+        :param int size_of_record_kb: size of every record, used when no profile is given
+        :param int number_of_records: number of records to write
+        :param str out_file_path: path of the data file
+        :param str profile_name: workload profile the records are sized by and processed with
+        :param int seed: seed of the profile's random number generator, so data files can be reproduced
+        """
         record = Record(size_of_record_kb)
+        profile = get_profile(profile_name, self.config, seed) if profile_name else None
 
         with open(out_file_path, 'w+') as out_file:
             for recordId in range(number_of_records):
-                record.id = recordId              
-                encrypted_record = self.aes_cipher.encrypt(json.dumps(record.__dict__))
+                record.id = recordId
+                if profile is not None:
+                    record.profile = profile.name
+                    record.data = "A" * profile.record_size()
+                encrypted_record = self.aes_cipher.encrypt(self.payload_compressor.encode(json.dumps(record.__dict__)))
                 out_file.writelines(base64.b64encode(encrypted_record)+'\n')
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate encrypted data files')
+    parser.add_argument('--profile', help='workload profile to generate the records for, see app/workloadprofiles.py')
+    parser.add_argument('--seed', help='random seed of the workload profile', type=int)
+    args = parser.parse_args()
+
     config = Config()
     data_generator = DataGenerator(config)
 
-    data_generator.generate_data(1, 10, "data/data.10.encrypted")
-    data_generator.generate_data(1, 100, "data/data.100.encrypted")
-    data_generator.generate_data(1, 1000, "data/data.1000.encrypted")
-    data_generator.generate_data(1, 10000, "data/data.10000.encrypted")
+    data_generator.generate_data(1, 10, "data/data.10.encrypted", args.profile, args.seed)
+    data_generator.generate_data(1, 100, "data/data.100.encrypted", args.profile, args.seed)
+    data_generator.generate_data(1, 1000, "data/data.1000.encrypted", args.profile, args.seed)
+    data_generator.generate_data(1, 10000, "data/data.10000.encrypted", args.profile, args.seed)
 
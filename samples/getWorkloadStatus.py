@@ -90,6 +90,7 @@ class Workload(object):
         
         # Jobs Queued
         print "All Jobs Queued: " + str(self.jobs_queued_done.timestamp)
+        print "Jobs Queued: " + self.jobs_queued_done.contents
         elapse = self.time_elapse(self.scheduler_start_event, self.jobs_queued_done)
         print "Jobs Queued Elapsed Time: " + str(elapse[0]) + " mins, " + str(elapse[1]) + " secs" 
         
@@ -1,39 +1,61 @@
 """
-    Simple class that reads in the results file, decodes each lines, and prints the results
+    Simple command line reader of the consolidated results, prints the id and size of every result
 """
-import base64
-import io
+import argparse
 import json
 from app.aeshelper import AESHelper
+from app.compression import PayloadCompressor
 from app.config import Config
+from app.resultsreader import ResultsReader
+from app.resultshards import read_indexed_result
 from azure.storage.blob import BlockBlobService
 
-class Record(object):
-    def __init__(self, id, data):
-        self.id = id
-        self.data = data
-
-def as_payload(dct):
-    return Record(dct['id'], dct['data'])
+def print_record(record):
+    print str(record['id']) + " " + str(len(record['data']) / 1024) + "KB"
 
 if __name__ == "__main__":
-    config = Config()
-    aes_helper = AESHelper(config)
+    parser = argparse.ArgumentParser(description='Read the consolidated results')
+    parser.add_argument('--processes', help='number of decrypting processes, defaults to one per cpu', type=int)
+    parser.add_argument('--downloads', help='number of parallel ranged GETs', type=int, default=8)
+    parser.add_argument('--recordId', help='job status id of a single result to read from the binary shards')
+    parser.add_argument('--shard', help='name of the binary shard to look the single result up in, defaults to all')
+    args = parser.parse_args()
+    if args.shard is not None and args.recordId is None:
+        parser.error('--shard needs --recordId')
 
-    aes_cipher = aes_helper.create_aescipher_from_config()
+    config = Config()
+    aes_cipher = AESHelper(config).create_aescipher_from_config()
 
     storage_service = BlockBlobService(account_name = config.storage_account_name, sas_token = config.results_container_sas_token)
-
-    results = []
-    with io.BytesIO() as blobContents:
-        storage_service.get_blob_to_stream(config.results_container_name, config.results_consolidated_file, blobContents)
-        blobContents.seek(0)
-
-        for result in blobContents.readlines():
-            decoded = aes_cipher.decrypt(base64.b64decode(result))
-            record = json.loads(decoded, object_hook = as_payload)
-            print str(record.id) + " " + str(len(record.data) / 1024) + "KB"
-            results.append(record.id)
-
-    print results
-    print len(results)
+    reader = ResultsReader(config, storage_service, aes_cipher, processes=args.processes, downloads=args.downloads)
+
+    # read a single result of the binary shards with its index entry and a ranged GET
+    if args.recordId is not None:
+        shards = reader.get_shards()
+        if args.shard is not None:
+            shards = [shard for shard in shards if shard['name'] == args.shard]
+            if not shards:
+                parser.error('shard {0} is not in the manifest'.format(args.shard))
+            if shards[0]['format'] != 'binary':
+                parser.error('shard {0} is a text shard, only binary shards are indexed'.format(args.shard))
+
+        shards = [shard for shard in shards if shard['format'] == 'binary']
+        if not shards:
+            parser.error('the consolidated results have no binary shards, only binary shards are indexed')
+
+        found = read_indexed_result(storage_service, config, shards, args.recordId)
+        if found is None:
+            print 'Result ' + args.recordId + ' not found'
+            exit(1)
+
+        shard_name, ciphertext = found
+        print shard_name
+        print_record(json.loads(PayloadCompressor().decode(aes_cipher.decrypt(ciphertext))))
+        exit(0)
+
+    count = 0
+    for record in reader:
+        print_record(record)
+        count += 1
+
+    print count